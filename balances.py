@@ -0,0 +1,158 @@
+import asyncio
+import logging
+
+from session import get_session
+
+# Seconds to wait for the first balance snapshot
+START_TIMEOUT = 30
+
+
+class BalanceCache:
+    """
+    Keeps a `SubscribeBalance` subscription open and mirrors the user's balances in memory.
+    Every push is merged into per-currency state keyed by the currency index (the position
+    in CURRENCY_IDS), so reads never go to the network. `balance_field` is the field of a
+    currency entry that holds the spendable amount.
+    """
+
+    def __init__(self, session, user_id, node_id, balance_field="Balance"):
+        self.session = session
+        self.user_id = user_id
+        self.node_id = node_id
+        self.balance_field = balance_field
+        self._balances = {}
+        self._callbacks = []
+        self._ready = None
+        self._changed = None
+        self._started = None
+
+    @property
+    def ready(self) -> asyncio.Event:
+        """
+        Set once the first balance snapshot has arrived.
+        """
+        # Created on first use so that they belong to the running event loop
+        if self._ready is None:
+            self._ready = asyncio.Event()
+            self._changed = asyncio.Condition()
+        return self._ready
+
+    async def start(self, timeout=START_TIMEOUT):
+        """
+        Subscribes to balance updates and waits for the first snapshot.
+        Raises RuntimeError if the node rejects the subscription, TimeoutError if no
+        snapshot arrives within `timeout` seconds.
+        """
+        # Creates the event and condition on the running loop
+        self.ready
+        self._started = asyncio.get_running_loop().create_future()
+        subscription = {
+            "Type": "SubscribeBalance",
+            "UserID": self.user_id,
+            "NodeID": self.node_id
+        }
+        await self.session.subscribe(subscription, self._on_message)
+        try:
+            await asyncio.wait_for(self._started, timeout)
+        except asyncio.TimeoutError:
+            self.session.unsubscribe(subscription, self._on_message)
+            raise TimeoutError(f"No balance snapshot for user {self.user_id} after {timeout} seconds")
+        except Exception:
+            self.session.unsubscribe(subscription, self._on_message)
+            raise
+        logging.info(f"Balance cache ready for user {self.user_id}")
+
+    def get(self, currency_id) -> dict:
+        """
+        Returns the last known entry of a currency, or an empty dict.
+        """
+        return self._balances.get(int(currency_id), {})
+
+    def available(self, currency_id) -> float:
+        """
+        Returns the spendable amount of a currency, 0 if the node reported no entry for it.
+        Raises KeyError if the entry has no `balance_field`, rather than reading it as 0.
+        """
+        entry = self._balances.get(int(currency_id))
+        if entry is None:
+            return 0.0
+        if self.balance_field not in entry:
+            raise KeyError(f"Balance entry of currency {currency_id} has no {self.balance_field!r} field: {entry}")
+        return float(entry[self.balance_field] or 0)
+
+    def snapshot(self) -> dict:
+        return {currency_id: dict(entry) for currency_id, entry in self._balances.items()}
+
+    def on_change(self, callback):
+        """
+        Registers `callback(currency_id, entry)`, called whenever a currency entry changes.
+        """
+        self._callbacks.append(callback)
+
+    async def wait_for_balance(self, currency_id, amount, timeout=None) -> float:
+        """
+        Waits until the available balance of a currency is at least `amount` and returns it.
+        """
+        await self.ready.wait()
+        async with self._changed:
+            await asyncio.wait_for(
+                self._changed.wait_for(lambda: self.available(currency_id) >= amount),
+                timeout
+            )
+        return self.available(currency_id)
+
+    def _on_message(self, message):
+        if message.get("State") not in (None, "OK"):
+            logging.error(f"Balance subscription error: {message}")
+            if self._started is not None and not self._started.done():
+                self._started.set_exception(RuntimeError(f"Balance subscription rejected: {message.get('State')}"))
+            return
+        data = message.get("Data")
+        if not isinstance(data, dict):
+            return
+
+        changed = []
+        for idx, entry in data.items():
+            if not isinstance(entry, dict):
+                continue
+            try:
+                currency_id = int(idx)
+            except ValueError:
+                continue
+            current = self._balances.setdefault(currency_id, {})
+            if any(current.get(key) != value for key, value in entry.items()):
+                current.update(entry)
+                changed.append(currency_id)
+
+        self.ready.set()
+        if self._started is not None and not self._started.done():
+            self._started.set_result(None)
+        for currency_id in changed:
+            for callback in self._callbacks:
+                try:
+                    callback(currency_id, self._balances[currency_id])
+                except Exception as e:
+                    logging.error(f"Error in balance callback: {e}")
+        if changed:
+            asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+
+_caches = {}
+
+
+async def get_balance_cache(url, user_id, node_id) -> BalanceCache:
+    """
+    Returns a started balance cache for the user, shared by everything in the process.
+    """
+    session = await get_session(url)
+    key = (url, str(user_id), str(node_id))
+    cache = _caches.get(key)
+    if cache is None or cache.session is not session:
+        cache = BalanceCache(session, user_id, node_id)
+        await cache.start()
+        _caches[key] = cache
+    return cache
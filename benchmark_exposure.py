@@ -0,0 +1,60 @@
+import sys
+import time
+import numpy as np
+from exposure import OrderArrays, market_exposure
+from risk import liability
+
+ORDERS = 100000
+MARKETS = 1000
+
+
+def python_exposure(orders):
+    # The order-at-a-time version of market_exposure, for comparison
+    results = {}
+    for order in orders:
+        market = results.setdefault(order["MarketID"], [0.0, 0.0, 0.0, 0.0])
+        matched = order["Amount"] - order["RemAmount"]
+        odds = order["Price"] - 1
+        if order["Side"] == 1:
+            market[0] += matched * odds
+            market[1] -= order["Amount"]
+            market[2] += order["Amount"]
+        else:
+            market[0] -= order["Amount"] * odds
+            market[1] += matched
+            market[2] -= order["Amount"]
+        market[3] += liability(order["Side"], order["Price"], order["RemAmount"])
+    return results
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else ORDERS
+    rng = np.random.default_rng(1)
+    amount = rng.uniform(0.001, 2.0, count).round(6)
+    columns = (
+        rng.integers(0, MARKETS, count),
+        rng.integers(1, 3, count),
+        rng.uniform(1.01, 10.0, count).round(2),
+        amount,
+        (amount * rng.uniform(0.0, 1.0, count)).round(6),
+    )
+    orders = [
+        {"MarketID": int(m), "Side": int(s), "Price": float(p), "Amount": float(a), "RemAmount": float(r)}
+        for m, s, p, a, r in zip(*columns)
+    ]
+
+    started = time.perf_counter()
+    python_exposure(orders)
+    python_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    arrays = OrderArrays.from_orders(orders)
+    convert_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    market_exposure(arrays)
+    numpy_time = time.perf_counter() - started
+
+    print(f"{count} orders over {MARKETS} markets")
+    print(f"python loop: {python_time * 1000:.1f} ms")
+    print(f"numpy: {numpy_time * 1000:.1f} ms (+{convert_time * 1000:.1f} ms to build the arrays)")
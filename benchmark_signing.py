@@ -0,0 +1,35 @@
+import os
+import sys
+import time
+import asyncio
+from signing import SigningService
+
+# Throwaway key, the benchmark never talks to the network
+PRIVATE_KEY = "0x" + "11" * 32
+MESSAGES = 2000
+
+
+async def run(workers, use_processes, messages):
+    with SigningService(PRIVATE_KEY, workers=workers, use_processes=use_processes) as signer:
+        # Warm up the pool so worker start-up is not measured
+        await signer.sign_batch(messages[:workers])
+        started = time.perf_counter()
+        await signer.sign_batch(messages)
+        return len(messages) / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    messages = [f'{{"Amount":1.0,"ID":"order-{i}","Price":1.5}}' for i in range(MESSAGES)]
+
+    started = time.perf_counter()
+    signer = SigningService(PRIVATE_KEY)
+    for message in messages[:200]:
+        signer.sign(message)
+    print(f"inline: {200 / (time.perf_counter() - started):.0f} signatures/s")
+
+    for workers in range(1, max_workers + 1):
+        for use_processes in (False, True):
+            rate = asyncio.run(run(workers, use_processes, messages))
+            pool = "processes" if use_processes else "threads"
+            print(f"{workers} {pool}: {rate:.0f} signatures/s")
@@ -0,0 +1,166 @@
+import json
+from json.encoder import encode_basestring_ascii
+
+# Field layouts of the signed payload of each message type, in alphabetical order.
+# Payloads that match a layout exactly and have no empty values are rendered through
+# a precompiled template; anything else goes through the generic encoder.
+MESSAGE_LAYOUTS = {
+    "OrderAlteration": (
+        {
+            "CreatedByUser": None,
+            "MinerFeeStr": None,
+            "UnmatchedOrder": {
+                "Amount": None,
+                "ID": None,
+                "Price": None,
+                "RemAmount": None,
+                "Side": None,
+                "Type": None
+            },
+            "UserID": None,
+            "UserOrder": {
+                "MarketID": None
+            }
+        },
+    ),
+    "Transfer": (
+        # Transfer between users
+        {
+            "Amount": None,
+            "CreatedByUser": None,
+            "From": None,
+            "ID": None,
+            "MinerFeeStr": None,
+            "NodeID": None,
+            "To": None,
+            "UserID": None
+        },
+        # Withdraw request
+        {
+            "Amount": None,
+            "CreatedByUser": None,
+            "Cur": None,
+            "From": None,
+            "ID": None,
+            "MinerFeeStr": None,
+            "NodeID": None,
+            "Reference": None,
+            "TType": None,
+            "UserID": None
+        },
+    ),
+    "CurrencyIssuance": (
+        {
+            "Currency": {
+                "ID": None
+            },
+            "Deposit": {
+                "Amount": None,
+                "TXID": None,
+                "UserID": None
+            },
+            "MinerFeeStr": None,
+            "NodeID": None,
+            "UserID": None
+        },
+    ),
+}
+
+
+def _encode_float(value):
+    if value != value or value in (float("inf"), float("-inf")):
+        return json.dumps(value)
+    return float.__repr__(value)
+
+
+_ENCODERS = {
+    str: encode_basestring_ascii,
+    int: int.__repr__,
+    float: _encode_float,
+    bool: lambda value: "true",
+}
+
+
+def is_empty(value):
+    # Zero numbers, empty strings/containers, None and False are left out of signed payloads
+    return not value and value is not True
+
+
+def prune(data):
+    """
+    Returns a copy of `data` without empty values, recursively.
+    Containers that end up empty are removed as well.
+    """
+    if isinstance(data, dict):
+        pruned = {}
+        for key, value in data.items():
+            value = prune(value)
+            if not is_empty(value):
+                pruned[key] = value
+        return pruned
+    if isinstance(data, (list, tuple)):
+        return [prune(value) for value in data]
+    return data
+
+
+def _compile(layout):
+    """
+    Generates a render function for one layout. It returns the canonical JSON text of a
+    payload with exactly the layout's fields and no empty values, or None otherwise.
+    """
+    namespace = {"_encoders": _ENCODERS}
+    body = []
+    values = []
+
+    def walk(variable, layout):
+        keys_name = f"_keys{len(namespace)}"
+        namespace[keys_name] = frozenset(layout)
+        body.append(f"if type({variable}) is not dict or {variable}.keys() != {keys_name}: return None")
+        parts = []
+        for name in sorted(layout):
+            value = f"{variable}[{name!r}]"
+            if layout[name] is None:
+                values.append(value)
+                text = "%s"
+            else:
+                nested = f"d{len(body)}"
+                body.append(f"{nested} = {value}")
+                text = walk(nested, layout[name])
+            parts.append(encode_basestring_ascii(name).replace("%", "%%") + ":" + text)
+        return "{" + ",".join(parts) + "}"
+
+    template = walk("data", layout)
+    source = "\n    ".join(
+        ["def render(data):"]
+        + body
+        + [
+            f"values = ({', '.join(values)},)",
+            "if not all(values): return None",
+            "try:",
+            f"    return {template!r} % tuple([_encoders[type(v)](v) for v in values])",
+            "except KeyError:",
+            "    return None",
+        ]
+    )
+    exec(source, namespace)
+    return namespace["render"]
+
+
+_encode = json.JSONEncoder(sort_keys=True, separators=(',', ':')).encode
+
+_TEMPLATES = {
+    message_type: tuple(_compile(layout) for layout in layouts)
+    for message_type, layouts in MESSAGE_LAYOUTS.items()
+}
+
+
+def canonical_dumps(data, message_type=None) -> str:
+    """
+    Serializes a payload exactly as it must be signed: keys sorted at every level,
+    empty and zeroed values removed, compact separators.
+    """
+    for template in _TEMPLATES.get(message_type, ()):
+        text = template(data)
+        if text is not None:
+            return text
+    return _encode(prune(data))
@@ -0,0 +1,126 @@
+import time
+import asyncio
+import logging
+
+from utils import unix_to_ticks
+from session import get_session
+from canonical import canonical_dumps
+
+# How long a block timestamp is used to derive claim nonces before it is read again
+NONCE_BLOCK_TTL = 60
+
+
+class ClaimQueue:
+    """
+    Claims on-chain deposits (CurrencyIssuance) in batches over the shared node session.
+    Claims queued while a batch is being signed and sent are collected into the next
+    batch; every batch is signed in the signing pool at once. Claim nonces are derived
+    from a cached block timestamp plus the time elapsed since it was read, so a burst of
+    claims costs one `get_block` call instead of one per claim; each claim of a batch
+    gets its own nonce. Leave `web3` unset for claims that carry no nonce (ERC20 deposits).
+    """
+
+    def __init__(self, node_url, signer, user_id, node_id, web3=None, max_in_flight=50, batch_size=256):
+        self.node_url = node_url
+        self.signer = signer
+        self.user_id = user_id
+        self.node_id = node_id
+        self.web3 = web3
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+        self._queue = []
+        self._task = None
+        self._block_time = None
+        self._read_at = 0.0
+        self._last_nonce = None
+
+    def submit(self, tx_hash, amount, currency_id) -> asyncio.Future:
+        """
+        Queues the claim of one deposit and returns a future resolving to its status:
+        {"TXID", "Status", "Response" | "Error"}.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((tx_hash.lower(), amount, currency_id, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return future
+
+    async def claim(self, tx_hash, amount, currency_id) -> dict:
+        return await self.submit(tx_hash, amount, currency_id)
+
+    async def claim_many(self, entries) -> list:
+        """
+        Claims many (tx_hash, amount, currency_id) deposits and returns their statuses in order.
+        """
+        return await asyncio.gather(*[self.submit(*entry) for entry in entries])
+
+    async def nonce(self, count=1):
+        """
+        Reserves `count` consecutive claim nonces and returns the first one. Nonces
+        never repeat, even when claims are issued faster than the clock advances.
+        """
+        if self._block_time is None or time.monotonic() - self._read_at > NONCE_BLOCK_TTL:
+            self._block_time = int((await self.web3.eth.get_block('latest'))['timestamp'])
+            self._read_at = time.monotonic()
+        nonce = unix_to_ticks(self._block_time + int(time.monotonic() - self._read_at)) // 10
+        if self._last_nonce is not None:
+            nonce = max(nonce, self._last_nonce + 1)
+        self._last_nonce = nonce + count - 1
+        return nonce
+
+    def build_issuance_data(self, tx_hash, amount, currency_id):
+        return {
+            "Currency": {"ID": currency_id},
+            "Deposit": {
+                "Amount": amount,
+                "TXID": tx_hash,
+                "UserID": self.user_id
+            },
+            "MinerFeeStr": "0.00001",
+            "NodeID": self.node_id,
+            "UserID": self.user_id
+        }
+
+    async def _run(self):
+        session = None
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        while self._queue:
+            batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+            try:
+                session = await get_session(self.node_url)
+                nonce = await self.nonce(len(batch)) if self.web3 is not None else None
+                payloads = [self.build_issuance_data(tx_hash, amount, currency_id) for tx_hash, amount, currency_id, _ in batch]
+                signatures = await self.signer.sign_batch(
+                    [canonical_dumps(issuance_data, "CurrencyIssuance") for issuance_data in payloads]
+                )
+            except Exception as e:
+                logging.error(f"Error preparing {len(batch)} claims: {e}")
+                for tx_hash, _, _, future in batch:
+                    if not future.done():
+                        future.set_result({"TXID": tx_hash, "Status": "Error", "Error": str(e)})
+                continue
+
+            sends = []
+            for index, ((tx_hash, _, _, future), issuance_data, signature) in enumerate(zip(batch, payloads, signatures)):
+                ws_message = {
+                    "Type": "CurrencyIssuance",
+                    "SignatureUser": signature,
+                    "Data": issuance_data
+                }
+                if nonce is not None:
+                    ws_message = {"Nonce": nonce + index, **ws_message}
+                sends.append(self._send(session, in_flight, ws_message, future))
+            await asyncio.gather(*sends)
+
+    async def _send(self, session, in_flight, ws_message, future):
+        tx_hash = ws_message["Data"]["Deposit"]["TXID"]
+        async with in_flight:
+            try:
+                response = await session.request(ws_message)
+                status = {"TXID": tx_hash, "Status": response.get("State"), "Response": response}
+                logging.info(f"Currency issuance status for {tx_hash}: {response.get('State')}")
+            except Exception as e:
+                logging.error(f"Claim of {tx_hash} failed: {e}")
+                status = {"TXID": tx_hash, "Status": "Error", "Error": str(e)}
+        if not future.done():
+            future.set_result(status)
@@ -1,12 +1,16 @@
 import os
-import json
 import logging
-from web3 import Web3
+from web3 import AsyncWeb3
 from eth_account import Account
-from eth_account.messages import encode_defunct
 import asyncio
-import websockets
-from utils import hex_to_base64, check_environment_variables, BB_CONTRACT_ADDRESS, ERC20_ABI, BB_ABI, CURRENCIES_DATA
+from utils import check_environment_variables, get_dynamic_gas, check_gas_used, BB_CONTRACT_ADDRESS, \
+    ERC20_ABI, BB_ABI, CURRENCIES_DATA
+from session import close_sessions
+from nonces import get_nonce_manager
+from fees import get_fee_oracle
+from receipts import get_receipt_tracker
+from signing import SigningService
+from claims import ClaimQueue
 
 # Configure logging
 logging.basicConfig(
@@ -29,7 +33,7 @@ NODE_ID = os.getenv("NODE_ID")
 NODE_URL = os.getenv("NODE_URL")
 RPC_ENDPOINT = os.getenv("RPC_ENDPOINT")
 
-web3 = Web3(Web3.HTTPProvider(RPC_ENDPOINT))
+web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(RPC_ENDPOINT))
 try:
     account = Account.from_key(PRIVATE_KEY)
     logging.info("Account initialized successfully.")
@@ -37,43 +41,85 @@ except Exception as e:
     logging.error(f"Failed to initialize account: {e}")
     exit(1)
 
+nonces = get_nonce_manager(web3, 1, account.address)
+fees = get_fee_oracle(web3, 1)
+receipts = get_receipt_tracker(web3, 1)
+# ERC20 claims carry no nonce
+claims = ClaimQueue(NODE_URL, SigningService(PRIVATE_KEY), USER_ID, NODE_ID)
+
+
+# Blocks on top of the deposit before it is claimed
+CLAIM_CONFIRMATIONS = 1
+
 
 def parse_units(amount, decimals):
     return int(amount * (10 ** decimals))
 
 
-async def send_allowance(amount, currency_id):
-    try:
-        currency = CURRENCIES_DATA[currency_id]
-        if not currency['contract']:
-            raise ValueError("Contract address is missing for the selected currency.")
+async def broadcast_approve(currency, amount_unit):
+    """
+    Signs and broadcasts approve() for the main contract without waiting for it to be mined.
+    Returns the contract function, the transaction and its hash.
+    """
+    erc20_contract = web3.eth.contract(address=currency['contract'], abi=ERC20_ABI)
+    approve = erc20_contract.functions.approve(BB_CONTRACT_ADDRESS, amount_unit)
+    async with nonces.reserve() as nonce:
+        transaction = {
+            'chainId': 1,  # Mainnet
+            'from': account.address,
+            **await fees.fee_params(),
+            'nonce': nonce
+        }
+        transaction['gas'] = await get_dynamic_gas(approve, transaction)
+        transaction = await approve.build_transaction(transaction)
 
-        erc20_contract = web3.eth.contract(address=currency['contract'], abi=ERC20_ABI)
-        amount_unit = parse_units(amount, currency['decimals'])
+        signed_tx = web3.eth.account.sign_transaction(transaction, private_key=PRIVATE_KEY)
+        tx_hash = await web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    logging.info(f"Approve transaction sent, hash: {web3.to_hex(tx_hash)}")
+    return approve, transaction, tx_hash
+
+
+async def broadcast_deposit(currency, currency_id, amount_unit, estimate_gas=True):
+    """
+    Signs and broadcasts depositERC() without waiting for it to be mined.
+    Returns the contract function, the transaction and its hash.
+    """
+    main_contract = web3.eth.contract(address=BB_CONTRACT_ADDRESS, abi=BB_ABI)
+    deposit = main_contract.functions.depositERC(
+        amount_unit,
+        currency['contract'],
+        currency_id,
+        int(USER_ID)
+    )
+    async with nonces.reserve() as nonce:
+        transaction = {
+            'chainId': 1,
+            'from': account.address,
+            **await fees.fee_params(),
+            'nonce': nonce
+        }
+        transaction['gas'] = await get_dynamic_gas(deposit, transaction, estimate=estimate_gas)
+        transaction = await deposit.build_transaction(transaction)
 
-        tx_without_gas = erc20_contract.functions.approve(
-            BB_CONTRACT_ADDRESS, amount_unit
-        ).build_transaction({
-            'chainId': 1,  # Mainnet
-            'gasPrice': web3.eth.gas_price,
-            'nonce': web3.eth.get_transaction_count(account.address)
-        })
+        signed_tx = web3.eth.account.sign_transaction(transaction, private_key=PRIVATE_KEY)
+        tx_hash = await web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+    logging.info(f"Deposit transaction sent, hash: {web3.to_hex(tx_hash)}")
+    return deposit, transaction, tx_hash
 
-        estimated_gas = get_dynamic_gas(tx_without_gas)
 
-        transaction = erc20_contract.functions.approve(
-            BB_CONTRACT_ADDRESS, amount_unit
-        ).build_transaction({
-            'chainId': 1,  # Mainnet
-            'gas': estimated_gas,
-            'gasPrice': web3.eth.gas_price,
-            'nonce': web3.eth.get_transaction_count(account.address)
-        })
+def get_currency(currency_id):
+    currency = CURRENCIES_DATA[currency_id]
+    if not currency['contract']:
+        raise ValueError("Contract address is missing for the selected currency.")
+    return currency
 
-        signed_tx = web3.eth.account.sign_transaction(transaction, private_key=PRIVATE_KEY)
-        tx_hash = web3.eth.send_raw_transaction(signed_tx.raw_transaction)
-        logging.info(f"Approve transaction sent, hash: {web3.to_hex(tx_hash)}")
-        receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
+
+async def send_allowance(amount, currency_id):
+    try:
+        currency = get_currency(currency_id)
+        approve, transaction, tx_hash = await broadcast_approve(currency, parse_units(amount, currency['decimals']))
+        receipt = await receipts.wait(tx_hash)
+        check_gas_used(approve, transaction, receipt)
         logging.info("Approve transaction confirmed: %s", receipt)
     except Exception as e:
         logging.error(f"Error in send_allowance: {e}")
@@ -82,42 +128,12 @@ async def send_allowance(amount, currency_id):
 
 async def send_deposit(amount, currency_id):
     try:
-        currency = CURRENCIES_DATA[currency_id]
-        if not currency['contract']:
-            raise ValueError("Contract address is missing for the selected currency.")
-
-        main_contract = web3.eth.contract(address=BB_CONTRACT_ADDRESS, abi=BB_ABI)
-        amount_unit = parse_units(amount, currency['decimals'])
-
-        tx_without_gas = main_contract.functions.depositERC(
-            amount_unit,
-            currency['contract'],
-            currency_id,
-            int(USER_ID)
-        ).build_transaction({
-            'chainId': 1,
-            'gasPrice': web3.eth.gas_price,
-            'nonce': web3.eth.get_transaction_count(account.address)
-        })
-
-        estimated_gas = get_dynamic_gas(tx_without_gas)
-
-        transaction = main_contract.functions.depositERC(
-            amount_unit,
-            currency['contract'],
-            currency_id,
-            int(USER_ID)
-        ).build_transaction({
-            'chainId': 1,
-            'gas': estimated_gas,
-            'gasPrice': web3.eth.gas_price,
-            'nonce': web3.eth.get_transaction_count(account.address)
-        })
-
-        signed_tx = web3.eth.account.sign_transaction(transaction, private_key=PRIVATE_KEY)
-        tx_hash = web3.eth.send_raw_transaction(signed_tx.raw_transaction)
-        logging.info(f"Deposit transaction sent, hash: {web3.to_hex(tx_hash)}")
-        receipt = web3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
+        currency = get_currency(currency_id)
+        deposit, transaction, tx_hash = await broadcast_deposit(
+            currency, currency_id, parse_units(amount, currency['decimals'])
+        )
+        receipt = await receipts.wait(tx_hash, timeout=120)
+        check_gas_used(deposit, transaction, receipt)
         logging.info("Deposit transaction confirmed: %s", receipt)
         return web3.to_hex(tx_hash)
     except Exception as e:
@@ -125,45 +141,73 @@ async def send_deposit(amount, currency_id):
         raise
 
 
-async def claim_deposit(deposit_hash, amount, currency_id):
+async def deposit_pipeline(amount, currency_id, confirmations=CLAIM_CONFIRMATIONS):
+    """
+    Deposits and claims ERC20 tokens without a block wait between the steps.
+    approve() is skipped when the allowance already covers the amount; otherwise it is
+    broadcast together with depositERC() on consecutive nonces, so both can land in the
+    same block. The claim goes out as soon as the deposit is `confirmations` blocks deep.
+    """
     try:
-        # ATTENTION: Make sure that all parameters are in alphabetical order.
-        issuance_data = {
-            "Currency": {"ID": currency_id},
-            "Deposit": {"Amount": amount, "TXID": deposit_hash, "UserID": USER_ID},
-            "MinerFeeStr": "0.00001",
-            "NodeID": NODE_ID,
-            "UserID": USER_ID
-        }
+        currency = get_currency(currency_id)
+        amount_unit = parse_units(amount, currency['decimals'])
 
-        message = json.dumps(issuance_data)
-        signature = web3.eth.account.sign_message(encode_defunct(text=message), private_key=PRIVATE_KEY).signature
+        erc20_contract = web3.eth.contract(address=currency['contract'], abi=ERC20_ABI)
+        allowance = await erc20_contract.functions.allowance(account.address, BB_CONTRACT_ADDRESS).call()
+        sent = []
+        if allowance < amount_unit:
+            sent.append(await broadcast_approve(currency, amount_unit))
+        else:
+            logging.info(f"Allowance of {allowance} already covers the deposit, skipping approve.")
+        # The deposit can't be estimated while its approve is still pending
+        sent.append(await broadcast_deposit(currency, currency_id, amount_unit, estimate_gas=len(sent) == 0))
+
+        confirmed = await asyncio.gather(*[
+            receipts.wait(tx_hash, timeout=300, confirmations=confirmations) for _, _, tx_hash in sent
+        ])
+        for (function, transaction, tx_hash), receipt in zip(sent, confirmed):
+            check_gas_used(function, transaction, receipt)
+            if receipt["status"] != 1:
+                raise RuntimeError(f"{function.fn_name} transaction {web3.to_hex(tx_hash)} reverted.")
+        logging.info("Deposit transaction confirmed: %s", confirmed[-1])
+
+        deposit_hash = web3.to_hex(sent[-1][2])
+        await claim_deposit(deposit_hash, amount, currency_id)
+        return deposit_hash
+    except Exception as e:
+        logging.error(f"Error in deposit_pipeline: {e}")
+        raise
 
-        ws_message = {
-            "Type": "CurrencyIssuance",
-            "SignatureUser": hex_to_base64(signature.hex()),
-            "Data": issuance_data
-        }
 
-        async with websockets.connect(NODE_URL) as ws:
-            await ws.send(json.dumps(ws_message))
-            async for msg in ws:
-                response = json.loads(msg)
-                if response.get("Type") == "CurrencyIssuance":
-                    logging.info("Currency issuance status: %s", response.get("State"))
-                    break
+async def claim_deposit(deposit_hash, amount, currency_id):
+    try:
+        status = await claims.claim(deposit_hash, amount, currency_id)
+        logging.info("Currency issuance status: %s", status["Status"])
+        return status
     except Exception as e:
         logging.error(f"Error in claim_deposit: {e}")
         raise
 
 
+async def claim_deposits(deposits):
+    """
+    Claims many (deposit_hash, amount, currency_id) deposits in one batch over the shared session.
+    """
+    return await claims.claim_many(deposits)
+
+
+async def main(amount, currency_id):
+    try:
+        await deposit_pipeline(amount, currency_id)
+    finally:
+        await close_sessions()
+
+
 if __name__ == "__main__":
     currency_id = 2  # WBTC
     amount = 0.00001  # Example amount
 
     try:
-        asyncio.run(send_allowance(amount, currency_id))
-        deposit_hash = asyncio.run(send_deposit(amount, currency_id))
-        asyncio.run(claim_deposit(deposit_hash, amount, currency_id))
+        asyncio.run(main(amount, currency_id))
     except Exception as e:
         logging.error(f"Unhandled error: {e}")
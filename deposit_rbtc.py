@@ -1,12 +1,15 @@
 import os
-import json
 import logging
-from web3 import Web3
+from web3 import AsyncWeb3
 from eth_account import Account
-from eth_account.messages import encode_defunct
 import asyncio
-import websockets
-from utils import BB_CONTRACT_ADDRESS, BB_RSK_ABI, hex_to_base64, unix_to_ticks, check_environment_variables
+from utils import BB_CONTRACT_ADDRESS, BB_RSK_ABI, check_environment_variables
+from session import close_sessions
+from nonces import get_nonce_manager
+from fees import get_fee_oracle
+from receipts import get_receipt_tracker
+from signing import SigningService
+from claims import ClaimQueue
 
 # Configure logging
 logging.basicConfig(
@@ -29,7 +32,7 @@ NODE_ID = int(os.getenv("NODE_ID"))
 NODE_URL = os.getenv("NODE_URL")
 RPC_ENDPOINT = os.getenv("RPC_ENDPOINT")
 
-web3 = Web3(Web3.HTTPProvider(RPC_ENDPOINT))
+web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(RPC_ENDPOINT))
 try:
     account = Account.from_key(PRIVATE_KEY)
     logging.info("Account initialized successfully.")
@@ -37,6 +40,11 @@ except Exception as e:
     logging.error(f"Failed to initialize account: {e}")
     exit(1)
 
+nonces = get_nonce_manager(web3, 30, account.address)
+fees = get_fee_oracle(web3, 30)
+receipts = get_receipt_tracker(web3, 30)
+claims = ClaimQueue(NODE_URL, SigningService(PRIVATE_KEY), USER_ID, NODE_ID, web3=web3)
+
 def parse_ether(amount):
     return web3.to_wei(amount, 'ether')
 
@@ -45,25 +53,25 @@ async def send_deposit(amount, note):
         logging.info("Will deposit and monitor transaction.")
         main_contract = web3.eth.contract(address=BB_CONTRACT_ADDRESS, abi=BB_RSK_ABI)
         amount_unit = parse_ether(amount)
-        gasprice = int( web3.eth.gas_price*1.2)
 
-        transaction = main_contract.functions.deposit(USER_ID, note).build_transaction({
-            'chainId': 30,  # Mainnet
-            'gas': 300000,
-            'gasPrice': gasprice,
-            'nonce': web3.eth.get_transaction_count(account.address),
-            'value': amount_unit
-        })
+        async with nonces.reserve() as nonce:
+            transaction = await main_contract.functions.deposit(USER_ID, note).build_transaction({
+                'chainId': 30,  # Mainnet
+                'gas': 300000,
+                **await fees.fee_params(),
+                'nonce': nonce,
+                'value': amount_unit
+            })
 
-        # Sign the transaction
-        signed_tx = web3.eth.account.sign_transaction(transaction, PRIVATE_KEY)
+            # Sign the transaction
+            signed_tx = web3.eth.account.sign_transaction(transaction, PRIVATE_KEY)
 
-        # Send the raw transaction
-        tx_hash = web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            # Send the raw transaction
+            tx_hash = await web3.eth.send_raw_transaction(signed_tx.raw_transaction)
         logging.info(f"Transaction hash: {web3.to_hex(tx_hash)}")
 
         # Wait for the transaction receipt
-        receipt = web3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
+        receipt = await receipts.wait(tx_hash, timeout=120)
         logging.info(f"Deposit transaction confirmed: {receipt}")
         return web3.to_hex(tx_hash)
     except Exception as e:
@@ -73,49 +81,34 @@ async def send_deposit(amount, note):
 async def claim_deposit(deposit_hash, amount):
     try:
         logging.info(f"Will claim onchain deposit made on the Bitcoin Betting: {deposit_hash}")
-        nonce = unix_to_ticks(int(web3.eth.get_block('latest')['timestamp'])) // 10
-
-        issuance_data = {
-            "Currency": {"ID": 5},  # Example: mETH currency ID
-            "Deposit": {
-                "Amount": amount * 1000,
-                "TXID": deposit_hash.lower(),
-                "UserID": USER_ID
-            },
-            "MinerFeeStr": "0.00001",
-            "NodeID": NODE_ID,
-            "UserID": USER_ID
-        }
-
-        message = json.dumps(issuance_data,separators=(',', ':'))
-        print(message)
-        signature = web3.eth.account.sign_message(encode_defunct(text=message), private_key=PRIVATE_KEY).signature
-
-        ws_message = {
-            "Nonce": nonce,
-            "Type": "CurrencyIssuance",
-            "SignatureUser": hex_to_base64(signature.hex()),
-            "Data": issuance_data
-        }
-
-        async with websockets.connect(NODE_URL) as ws:
-            await ws.send(json.dumps(ws_message))
-            async for msg in ws:
-                response = json.loads(msg)
-                if response.get("Type") == "CurrencyIssuance":
-                    logging.info(f"Currency issuance status: {response}")
-                    break
+        status = await claims.claim(deposit_hash, amount * 1000, 5)  # RBTC currency ID
+        logging.info(f"Currency issuance status: {status}")
+        return status
     except Exception as e:
         logging.error(f"Error in claim_deposit: {e}")
         raise
 
 
-if __name__ == "__main__":
-    amount = 0.0001  #  0.0001 RBTC
+async def claim_deposits(deposits):
+    """
+    Claims many (deposit_hash, amount) RBTC deposits in one batch over the shared session.
+    """
+    return await claims.claim_many([(deposit_hash, amount * 1000, 5) for deposit_hash, amount in deposits])
+
+
+async def main(amount):
     try:
         #deposit_hash = "0xe2d43450237e6c36b7d5d07b5e2439bbad1f00ac9c083cea6f18d6f524705eb1"
-        deposit_hash = asyncio.run(send_deposit(amount,"test"))
+        deposit_hash = await send_deposit(amount,"test")
 
-        asyncio.run(claim_deposit(deposit_hash, amount))
+        await claim_deposit(deposit_hash, amount)
+    finally:
+        await close_sessions()
+
+
+if __name__ == "__main__":
+    amount = 0.0001  #  0.0001 RBTC
+    try:
+        asyncio.run(main(amount))
     except Exception as e:
         logging.error(f"Unhandled error: {e}")
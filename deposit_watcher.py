@@ -0,0 +1,213 @@
+import os
+import json
+import asyncio
+import logging
+from web3 import AsyncWeb3
+from eth_account import Account
+from utils import BB_CONTRACT_ADDRESS, EVENT_ABIS, CURRENCIES_DATA, check_environment_variables
+from session import close_sessions
+from signing import SigningService
+from claims import ClaimQueue
+
+# Currency of native-coin deposits, per chain ID: RBTC on RSK
+NATIVE_CURRENCY_IDS = {
+    30: 5,
+}
+
+DEPOSIT_EVENTS = ("Deposited", "ERC20Deposited")
+
+# Claims that failed to reach the node are retried on this many polls before giving up
+MAX_CLAIM_ATTEMPTS = 5
+
+
+class DepositWatcher:
+    """
+    Follows the Deposited and ERC20Deposited events of the main contract and claims every
+    deposit of ours once it is `confirmations` blocks deep: native deposits made for one
+    of `user_ids`, token deposits made from one of `addresses`. Native deposits are claimed
+    through `native_claims`, token deposits through `token_claims` (ClaimQueues).
+    The last scanned block is kept in `state_path`, so a restart resumes from there instead
+    of rescanning the chain. A claim the node rejects (e.g. already claimed by the deposit
+    script) is final; a claim that got no reply is kept in the state and retried on the
+    next polls, up to `MAX_CLAIM_ATTEMPTS` times, while scanning moves on.
+    Only chains with an event ABI in EVENT_ABIS (RSK) are supported.
+    """
+
+    def __init__(self, web3, chain_id, native_claims, token_claims, addresses, user_ids,
+                 state_path, confirmations=6, poll_interval=5.0, max_range=2000, start_block=None):
+        if chain_id not in EVENT_ABIS:
+            raise ValueError(f"No deposit events known for chain {chain_id}, supported chains: {list(EVENT_ABIS)}")
+        self.web3 = web3
+        self.chain_id = chain_id
+        self.native_claims = native_claims
+        self.token_claims = token_claims
+        self.addresses = {address.lower() for address in addresses}
+        self.user_ids = {int(user_id) for user_id in user_ids}
+        self.state_path = state_path
+        self.confirmations = confirmations
+        self.poll_interval = poll_interval
+        self.max_range = max_range
+        self.start_block = start_block
+        self.contract = web3.eth.contract(address=BB_CONTRACT_ADDRESS, abi=EVENT_ABIS[chain_id])
+        self._events = {
+            AsyncWeb3.to_hex(AsyncWeb3.keccak(text=self.contract.events[name].signature)): self.contract.events[name]()
+            for name in DEPOSIT_EVENTS
+        }
+        self._tokens = {
+            currency["contract"].lower(): (index, currency["decimals"])
+            for index, currency in enumerate(CURRENCIES_DATA) if currency.get("contract")
+        }
+        self._state = None
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as f:
+                self._state = json.load(f)
+        except FileNotFoundError:
+            self._state = {"last_block": None}
+        self._state.setdefault("retry", [])
+        return self._state
+
+    def save_state(self):
+        # Write to a temporary file first so a crash never leaves a truncated state file
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self._state, f)
+        os.replace(temp_path, self.state_path)
+
+    async def run(self):
+        """
+        Polls for new deposits until cancelled.
+        """
+        self.load_state()
+        logging.info(f"Watching deposits on chain {self.chain_id} from block {self._state['last_block']}")
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                logging.warning(f"Polling deposits failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll(self) -> int:
+        """
+        Claims the deposits in the next range of confirmed blocks, and retries earlier claims
+        that got no reply. Returns the number of claims made.
+        """
+        if self._state is None:
+            self.load_state()
+        safe_block = await self.web3.eth.block_number - self.confirmations + 1
+        last_block = self._state["last_block"]
+        if last_block is None:
+            last_block = (self.start_block if self.start_block is not None else safe_block) - 1
+        to_block = max(last_block, min(safe_block, last_block + self.max_range))
+
+        deposits = list(self._state["retry"])
+        if to_block > last_block:
+            logs = await self.web3.eth.get_logs({
+                "address": BB_CONTRACT_ADDRESS,
+                "fromBlock": last_block + 1,
+                "toBlock": to_block,
+                "topics": [list(self._events)]
+            })
+            retrying = {deposit["TXID"] for deposit in deposits}
+            for log in logs:
+                deposit = self.parse(log)
+                if deposit is not None and deposit["TXID"] not in retrying:
+                    deposits.append(deposit)
+        if not deposits and to_block == last_block:
+            return 0
+
+        retry = []
+        if deposits:
+            statuses = await asyncio.gather(*[
+                (self.native_claims if deposit["Native"] else self.token_claims).claim(
+                    deposit["TXID"], deposit["Amount"], deposit["Currency"]
+                ) for deposit in deposits
+            ])
+            for deposit, status in zip(deposits, statuses):
+                if status["Status"] == "OK":
+                    continue
+                if status["Status"] != "Error":
+                    # The node answered, retrying would get the same answer
+                    logging.warning(f"Claim of deposit {deposit['TXID']} rejected: {status['Status']}")
+                    continue
+                attempts = deposit.get("Attempts", 0) + 1
+                if attempts >= MAX_CLAIM_ATTEMPTS:
+                    logging.error(f"Giving up on claiming deposit {deposit['TXID']} after {attempts} attempts")
+                    continue
+                retry.append({**deposit, "Attempts": attempts})
+            logging.info(f"Claimed deposits up to block {to_block}: "
+                         f"{len(deposits) - len(retry)} done, {len(retry)} to retry")
+
+        self._state = {"last_block": to_block, "retry": retry}
+        self.save_state()
+        return len(deposits)
+
+    def parse(self, log):
+        """
+        Returns {"TXID", "Amount", "Currency", "Native"} for one of our deposits, else None.
+        """
+        topic = AsyncWeb3.to_hex(log["topics"][0])
+        event = self._events.get(topic)
+        if event is None:
+            return None
+        decoded = event.process_log(log)
+        args = decoded["args"]
+        tx_hash = AsyncWeb3.to_hex(decoded["transactionHash"]).lower()
+        if decoded["event"] == "Deposited":
+            # Claims are issued for our own user, so the deposit must be credited to it
+            if args["userId"] not in self.user_ids:
+                if args["sender"].lower() in self.addresses:
+                    logging.warning(f"Deposit {tx_hash} from our address is for user {args['userId']}, not claiming it")
+                return None
+            # Native amounts are claimed in milli units (mETH / mRBTC)
+            amount = float(AsyncWeb3.from_wei(args["amount"], "ether")) * 1000
+            return {"TXID": tx_hash, "Amount": amount, "Currency": NATIVE_CURRENCY_IDS[self.chain_id], "Native": True}
+        if args["from"].lower() not in self.addresses:
+            return None
+        token = self._tokens.get(args["tokenAddress"].lower())
+        if token is None:
+            logging.warning(f"Deposit {tx_hash} of unknown token {args['tokenAddress']}, not claiming it")
+            return None
+        currency_id, decimals = token
+        return {"TXID": tx_hash, "Amount": args["amount"] / 10 ** decimals, "Currency": currency_id, "Native": False}
+
+
+async def main():
+    check_environment_variables()
+    private_key = os.getenv("PRIVATE_KEY")
+    user_id = os.getenv("USER_ID")
+    node_id = os.getenv("NODE_ID")
+    node_url = os.getenv("NODE_URL")
+    web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(os.getenv("RPC_ENDPOINT")))
+    account = Account.from_key(private_key)
+    chain_id = await web3.eth.chain_id
+
+    signer = SigningService(private_key)
+    watcher = DepositWatcher(
+        web3, chain_id,
+        ClaimQueue(node_url, signer, user_id, node_id, web3=web3),
+        # ERC20 claims carry no nonce
+        ClaimQueue(node_url, signer, user_id, node_id),
+        addresses=[account.address],
+        user_ids=[user_id],
+        state_path=os.getenv("DEPOSIT_WATCHER_STATE", f"deposit_watcher_{chain_id}.json"),
+        confirmations=int(os.getenv("DEPOSIT_CONFIRMATIONS", 6))
+    )
+    try:
+        await watcher.run()
+    finally:
+        signer.close()
+        await close_sessions()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler()]
+    )
+    try:
+        asyncio.run(main())
+    except Exception as e:
+        logging.error(f"Unhandled error: {e}")
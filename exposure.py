@@ -0,0 +1,103 @@
+import numpy as np
+
+BUY = 1
+SELL = 2
+
+
+class OrderArrays:
+    """
+    Column arrays of many orders: market code, side, price, amount and rem_amount.
+    `markets` maps each market code back to its MarketID.
+    """
+
+    def __init__(self, markets, market, side, price, amount, rem_amount):
+        self.markets = markets
+        self.market = np.asarray(market, dtype=np.intp)
+        self.side = np.asarray(side, dtype=np.int8)
+        self.price = np.asarray(price, dtype=np.float64)
+        self.amount = np.asarray(amount, dtype=np.float64)
+        self.rem_amount = np.asarray(rem_amount, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.market)
+
+    @classmethod
+    def from_columns(cls, market_ids, side, price, amount, rem_amount):
+        markets, market = np.unique(np.asarray(market_ids), return_inverse=True)
+        return cls(markets.tolist(), market, side, price, amount, rem_amount)
+
+    @classmethod
+    def from_orders(cls, orders):
+        """
+        Builds the arrays from order dicts with MarketID, Side, Price, Amount and RemAmount,
+        such as the records of the order book.
+        """
+        orders = list(orders)
+        return cls.from_columns(
+            [order["MarketID"] for order in orders],
+            [order["Side"] for order in orders],
+            [order["Price"] for order in orders],
+            [order.get("Amount", order["RemAmount"]) for order in orders],
+            [order["RemAmount"] for order in orders],
+        )
+
+
+def implied_probability(price):
+    return 1.0 / np.asarray(price, dtype=np.float64)
+
+
+def liability(orders: OrderArrays, remaining=True):
+    """
+    Per-order liability: the stake for a Buy, the stake times (price - 1) for a Sell.
+    """
+    stake = orders.rem_amount if remaining else orders.amount
+    return np.where(orders.side == BUY, stake, stake * (orders.price - 1.0))
+
+
+def market_exposure(orders: OrderArrays) -> dict:
+    """
+    Computes per-market risk figures for all orders at once. Every array is indexed by
+    market code (see `orders.markets`):
+    - win_pnl / lose_pnl: P&L if the selection wins / loses, counting matched stakes plus
+      the losing side of every resting order as if it were matched;
+    - worst_case: the lower of the two;
+    - liability: total liability of the resting orders;
+    - net_exposure: backed minus laid stake over whole orders, positive when long;
+    - overround: 1 / best Sell price + 1 - 1 / best Buy price of the resting orders, NaN
+      when a side has no resting orders.
+    """
+    size = len(orders.markets)
+    buy = orders.side == BUY
+    odds = orders.price - 1.0
+    matched = orders.amount - orders.rem_amount
+    resting = orders.rem_amount
+
+    win = np.where(buy, matched * odds, -(matched + resting) * odds)
+    lose = np.where(buy, -(matched + resting), matched)
+    win_pnl = np.bincount(orders.market, weights=win, minlength=size)
+    lose_pnl = np.bincount(orders.market, weights=lose, minlength=size)
+
+    signed_stake = np.where(buy, orders.amount, -orders.amount)
+    net_exposure = np.bincount(orders.market, weights=signed_stake, minlength=size)
+    total_liability = np.bincount(orders.market, weights=liability(orders), minlength=size)
+
+    open_orders = resting > 0
+    max_sell = np.full(size, -np.inf)
+    min_buy = np.full(size, np.inf)
+    sells = open_orders & ~buy
+    buys = open_orders & buy
+    np.maximum.at(max_sell, orders.market[sells], orders.price[sells])
+    np.minimum.at(min_buy, orders.market[buys], orders.price[buys])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        overround = 1.0 / max_sell + 1.0 - 1.0 / min_buy
+    overround[np.isinf(max_sell) | np.isinf(min_buy)] = np.nan
+
+    return {
+        "markets": orders.markets,
+        "win_pnl": win_pnl,
+        "lose_pnl": lose_pnl,
+        "worst_case": np.minimum(win_pnl, lose_pnl),
+        "liability": total_liability,
+        "net_exposure": net_exposure,
+        "overround": overround,
+    }
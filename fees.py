@@ -0,0 +1,95 @@
+import time
+import asyncio
+import logging
+import threading
+
+# Multiplier applied on top of the node's fee suggestion, per chain ID
+FEE_MULTIPLIERS = {
+    1: 1.0,   # Ethereum
+    30: 1.2,  # RSK
+}
+
+# How long a fee quote is reused when no newer block has been seen, per chain ID
+FEE_TTL_SECONDS = {
+    1: 12,
+    30: 30,
+}
+
+
+class FeeOracle:
+    """
+    Caches the fee parameters of one chain.
+    A quote is reused until a newer block is observed or the TTL expires. On chains with
+    EIP-1559 (the latest block has a base fee) transactions get maxFeePerGas and
+    maxPriorityFeePerGas, everywhere else a legacy gasPrice. The chain multiplier from
+    FEE_MULTIPLIERS is applied to the fee suggestion in both cases.
+    """
+
+    def __init__(self, web3, chain_id, multiplier=None, ttl=None):
+        self.web3 = web3
+        self.chain_id = chain_id
+        self.multiplier = multiplier or FEE_MULTIPLIERS.get(chain_id, 1.0)
+        self.ttl = ttl or FEE_TTL_SECONDS.get(chain_id, 15)
+        self._params = None
+        self._block_number = None
+        self._fetched_at = 0.0
+        self._lock = None
+
+    async def fee_params(self) -> dict:
+        """
+        Returns the fee fields to merge into a transaction.
+        """
+        # Created on first use so that the lock belongs to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._params is None or time.monotonic() - self._fetched_at > self.ttl:
+                await self._refresh()
+            return dict(self._params)
+
+    async def gas_price(self) -> int:
+        """
+        Returns the legacy gas price, or the max fee per gas on EIP-1559 chains.
+        """
+        params = await self.fee_params()
+        return params.get("gasPrice", params.get("maxFeePerGas"))
+
+    def observe_block(self, number):
+        """
+        Drops the cached quote once a block newer than the one it was taken at is seen.
+        """
+        if self._block_number is not None and number > self._block_number:
+            self._params = None
+
+    def invalidate(self):
+        self._params = None
+
+    async def _refresh(self):
+        block = await self.web3.eth.get_block("latest")
+        base_fee = block.get("baseFeePerGas")
+        if base_fee is not None:
+            priority_fee = int(await self.web3.eth.max_priority_fee * self.multiplier)
+            self._params = {
+                "maxFeePerGas": int(base_fee * 2 * self.multiplier) + priority_fee,
+                "maxPriorityFeePerGas": priority_fee,
+            }
+        else:
+            self._params = {"gasPrice": int(await self.web3.eth.gas_price * self.multiplier)}
+        self._block_number = block["number"]
+        self._fetched_at = time.monotonic()
+        logging.info(f"Fee quote for chain {self.chain_id} at block {self._block_number}: {self._params}")
+
+
+_oracles = {}
+_oracles_lock = threading.Lock()
+
+
+def get_fee_oracle(web3, chain_id) -> FeeOracle:
+    """
+    Returns the shared fee oracle of `chain_id`.
+    """
+    with _oracles_lock:
+        oracle = _oracles.get(chain_id)
+        if oracle is None:
+            oracle = _oracles[chain_id] = FeeOracle(web3, chain_id)
+        return oracle
@@ -1,8 +1,8 @@
 import os
-import json
 import asyncio
-import websockets
 from utils import check_environment_variables
+from session import close_sessions
+from balances import get_balance_cache
 
 # Check environment variables
 check_environment_variables()
@@ -15,34 +15,25 @@ NODE_ID = os.getenv("NODE_ID")
 
 async def get_balance():
     try:
-        async with websockets.connect(NODE_URL) as ws:
-            # Subscribe to balance updates
-            await ws.send(json.dumps({
-                "Type": "SubscribeBalance",
-                "UserID": USER_ID,
-                "NodeID": NODE_ID
-            }))
-
-            # Listen for messages
-            async for message in ws:
-                data_object = json.loads(message)
-                if data_object.get("Type") == "SubscribeBalance":
-                    for idx, curr in enumerate(CURRENCY_IDS):
-                        curr_data = data_object.get("Data", {}).get(str(idx))
-                        if not curr_data:
-                            continue
-
-                        decoded = {
-                            "id": str(idx),
-                            "symbol": curr,
-                            **curr_data
-                        }
-                        print(decoded)
-
-                    break  # Exit after processing the first message
+        # Subscribe to balance updates and print the first snapshot from the cache
+        balances = await get_balance_cache(NODE_URL, USER_ID, NODE_ID)
+
+        for idx, curr in enumerate(CURRENCY_IDS):
+            curr_data = balances.get(idx)
+            if not curr_data:
+                continue
+
+            decoded = {
+                "id": str(idx),
+                "symbol": curr,
+                **curr_data
+            }
+            print(decoded)
 
     except Exception as e:
         print("Error:", e)
+    finally:
+        await close_sessions()
 
 
 if __name__ == "__main__":
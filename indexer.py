@@ -0,0 +1,262 @@
+import os
+import asyncio
+import logging
+import sqlite3
+from dotenv import load_dotenv
+from web3 import AsyncWeb3
+from utils import BB_CONTRACT_ADDRESS, EVENT_ABIS
+
+INDEXED_EVENTS = ("Deposited", "ERC20Deposited", "Withdraw", "ERC20Withdraw")
+
+# Event argument holding the account on our side of the transfer
+ACCOUNT_ARGS = {
+    "Deposited": "sender",
+    "ERC20Deposited": "from",
+    "Withdraw": "receiver",
+    "ERC20Withdraw": "to",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    chain_id INTEGER NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    tx_hash TEXT NOT NULL,
+    event TEXT NOT NULL,
+    account TEXT NOT NULL,
+    user_id TEXT,
+    token TEXT,
+    amount TEXT NOT NULL,
+    PRIMARY KEY (chain_id, block_number, log_index)
+);
+CREATE INDEX IF NOT EXISTS events_account ON events (account, chain_id, timestamp);
+CREATE INDEX IF NOT EXISTS events_user ON events (user_id, chain_id, timestamp);
+CREATE INDEX IF NOT EXISTS events_event ON events (chain_id, event, timestamp);
+CREATE INDEX IF NOT EXISTS events_tx ON events (tx_hash);
+CREATE TABLE IF NOT EXISTS progress (
+    chain_id INTEGER PRIMARY KEY,
+    last_block INTEGER NOT NULL
+);
+"""
+
+
+def connect(path) -> sqlite3.Connection:
+    """
+    Opens the index database in WAL mode, so readers are not blocked while the indexer writes.
+    """
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    _migrate_user_id(db)
+    return db
+
+
+def _migrate_user_id(db):
+    # User IDs are uint256 on chain and overflow SQLite integers, so they are stored as
+    # decimal text. Indexes created before that are rebuilt once with the column as TEXT.
+    columns = {row[1]: row[2] for row in db.execute("PRAGMA table_info(events)")}
+    if columns.get("user_id", "TEXT").upper() == "TEXT":
+        return
+    logging.info("Converting events.user_id to TEXT")
+    with db:
+        db.execute("ALTER TABLE events RENAME TO events_old")
+        db.execute("DROP INDEX IF EXISTS events_account")
+        db.execute("DROP INDEX IF EXISTS events_user")
+        db.execute("DROP INDEX IF EXISTS events_event")
+        db.execute("DROP INDEX IF EXISTS events_tx")
+    db.executescript(SCHEMA)
+    with db:
+        db.execute(
+            "INSERT INTO events SELECT chain_id, block_number, log_index, timestamp, tx_hash, event, account, "
+            "CAST(user_id AS TEXT), token, amount FROM events_old"
+        )
+        db.execute("DROP TABLE events_old")
+
+
+class EventIndexer:
+    """
+    Copies the deposit and withdrawal events of the main contract into SQLite.
+    Block ranges are fetched `parallel` at a time. A range the node refuses (too many
+    results, range too large, timeout) is split in half and the chunk size shrinks; ranges
+    that come back light let it grow again. Each round is inserted in one transaction
+    together with the chain's high-water mark, so an interrupted run resumes where it
+    stopped. Only blocks `confirmations` deep are indexed.
+    Amounts are stored as decimal text, since uint256 does not fit SQLite integers.
+    Only chains with an event ABI in EVENT_ABIS (RSK) are supported.
+    """
+
+    def __init__(self, web3, chain_id, db, start_block=0, confirmations=12, chunk_size=2000,
+                 min_chunk_size=10, max_chunk_size=50000, target_logs=5000, parallel=4):
+        if chain_id not in EVENT_ABIS:
+            raise ValueError(f"No contract events known for chain {chain_id}, supported chains: {list(EVENT_ABIS)}")
+        self.web3 = web3
+        self.chain_id = chain_id
+        self.db = db
+        self.start_block = start_block
+        self.confirmations = confirmations
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.target_logs = target_logs
+        self.parallel = parallel
+        contract = web3.eth.contract(address=BB_CONTRACT_ADDRESS, abi=EVENT_ABIS[chain_id])
+        self._events = {
+            AsyncWeb3.to_hex(AsyncWeb3.keccak(text=contract.events[name].signature)): contract.events[name]()
+            for name in INDEXED_EVENTS
+        }
+
+    @property
+    def last_block(self):
+        row = self.db.execute("SELECT last_block FROM progress WHERE chain_id = ?", (self.chain_id,)).fetchone()
+        return row[0] if row else self.start_block - 1
+
+    async def sync(self, to_block=None) -> int:
+        """
+        Indexes everything from the high-water mark up to `to_block` (default: the last
+        confirmed block) and returns the number of events stored.
+        """
+        if to_block is None:
+            to_block = await self.web3.eth.block_number - self.confirmations + 1
+        stored = 0
+        last_block = self.last_block
+        while last_block < to_block:
+            ranges = []
+            start = last_block + 1
+            for _ in range(self.parallel):
+                if start > to_block:
+                    break
+                end = min(start + self.chunk_size - 1, to_block)
+                ranges.append((start, end))
+                start = end + 1
+
+            results = await asyncio.gather(*[self._fetch(start, end) for start, end in ranges])
+            logs = [log for result in results for log in result]
+            rows = await self._rows(logs)
+            last_block = ranges[-1][1]
+            with self.db:
+                self.db.executemany("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self.db.execute(
+                    "INSERT INTO progress (chain_id, last_block) VALUES (?, ?) "
+                    "ON CONFLICT (chain_id) DO UPDATE SET last_block = excluded.last_block",
+                    (self.chain_id, last_block)
+                )
+            stored += len(rows)
+            logging.info(f"Indexed chain {self.chain_id} up to block {last_block}: {len(rows)} events, "
+                         f"chunk size {self.chunk_size}")
+        return stored
+
+    async def run(self, poll_interval=15.0):
+        """
+        Keeps the index up to date until cancelled.
+        """
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logging.warning(f"Indexing chain {self.chain_id} failed: {e}")
+            await asyncio.sleep(poll_interval)
+
+    async def _fetch(self, start, end) -> list:
+        try:
+            logs = await self.web3.eth.get_logs({
+                "address": BB_CONTRACT_ADDRESS,
+                "fromBlock": start,
+                "toBlock": end,
+                "topics": [list(self._events)]
+            })
+        except Exception as e:
+            if end - start + 1 <= self.min_chunk_size:
+                raise
+            self.chunk_size = max(self.min_chunk_size, (end - start + 1) // 2)
+            logging.info(f"get_logs {start}-{end} failed ({e}), splitting the range")
+            middle = (start + end) // 2
+            first, second = await asyncio.gather(self._fetch(start, middle), self._fetch(middle + 1, end))
+            return first + second
+
+        if len(logs) < self.target_logs // 2 and end - start + 1 >= self.chunk_size:
+            self.chunk_size = min(self.max_chunk_size, self.chunk_size * 2)
+        return logs
+
+    async def _rows(self, logs) -> list:
+        blocks = sorted({log["blockNumber"] for log in logs})
+        in_flight = asyncio.Semaphore(self.parallel * 8)
+
+        async def get_block(number):
+            async with in_flight:
+                return await self.web3.eth.get_block(number)
+
+        headers = await asyncio.gather(*[get_block(number) for number in blocks])
+        timestamps = {number: header["timestamp"] for number, header in zip(blocks, headers)}
+
+        rows = []
+        for log in logs:
+            event = self._events.get(AsyncWeb3.to_hex(log["topics"][0]))
+            if event is None:
+                continue
+            decoded = event.process_log(log)
+            args = decoded["args"]
+            token = args.get("tokenAddress")
+            rows.append((
+                self.chain_id,
+                decoded["blockNumber"],
+                decoded["logIndex"],
+                timestamps[decoded["blockNumber"]],
+                AsyncWeb3.to_hex(decoded["transactionHash"]).lower(),
+                decoded["event"],
+                args[ACCOUNT_ARGS[decoded["event"]]].lower(),
+                str(args["userId"]) if args.get("userId") is not None else None,
+                token.lower() if token else None,
+                str(args["amount"]),
+            ))
+        return rows
+
+
+def query_events(db, chain_id=None, event=None, account=None, user_id=None, since=None, until=None):
+    """
+    Yields indexed events as dicts, oldest first. `since`/`until` are Unix timestamps.
+    """
+    conditions, params = [], []
+    user_id = str(user_id) if user_id is not None else None
+    for column, value in (("chain_id", chain_id), ("event", event), ("user_id", user_id)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if account is not None:
+        conditions.append("account = ?")
+        params.append(account.lower())
+    if since is not None:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("timestamp < ?")
+        params.append(until)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = db.execute(f"SELECT * FROM events {where} ORDER BY timestamp, block_number, log_index", params)
+    columns = [column[0] for column in cursor.description]
+    for row in cursor:
+        yield dict(zip(columns, row))
+
+
+async def main():
+    load_dotenv()
+    web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(os.getenv("RPC_ENDPOINT")))
+    chain_id = await web3.eth.chain_id
+    indexer = EventIndexer(
+        web3, chain_id, connect(os.getenv("INDEX_DB", "events.db")),
+        start_block=int(os.getenv("INDEX_START_BLOCK", 0))
+    )
+    await indexer.run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler()]
+    )
+    try:
+        asyncio.run(main())
+    except Exception as e:
+        logging.error(f"Unhandled error: {e}")
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+# Node errors after which the local nonce can no longer be trusted
+NONCE_ERRORS = ("nonce too low", "nonce too high", "invalid nonce", "already known",
+                "replacement transaction underpriced")
+
+
+def is_nonce_error(error) -> bool:
+    message = str(error).lower()
+    return any(text in message for text in NONCE_ERRORS)
+
+
+class NonceManager:
+    """
+    Hands out transaction nonces for one account on one chain.
+    The starting nonce is read from the node once (including pending transactions);
+    after that nonces are allocated locally, so several transactions can be built and
+    broadcast back-to-back without waiting for the previous one to be mined.
+    """
+
+    def __init__(self, web3, address):
+        self.web3 = web3
+        self.address = address
+        self._next = None
+        self._lock = None
+
+    async def allocate(self) -> int:
+        # Created on first use so that the lock belongs to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._next is None:
+                await self._sync()
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    @asynccontextmanager
+    async def reserve(self):
+        """
+        Allocates a nonce for building and broadcasting one transaction.
+        If the block raises, the nonce is released (the transaction never went out).
+        """
+        nonce = await self.allocate()
+        try:
+            yield nonce
+        except Exception as e:
+            self.release(nonce, e)
+            raise
+
+    def release(self, nonce, error=None):
+        """
+        Returns a nonce whose transaction was never broadcast.
+        The last allocated nonce is simply handed out again; anything else would leave
+        a gap, so the next allocation resyncs from the node instead.
+        """
+        if error is None or not is_nonce_error(error):
+            if self._next is not None and nonce == self._next - 1:
+                self._next = nonce
+                return
+        logging.warning(f"Resyncing nonce for {self.address} after: {error}")
+        self._next = None
+
+    def resync(self):
+        self._next = None
+
+    async def _sync(self):
+        self._next = await self.web3.eth.get_transaction_count(self.address, "pending")
+        logging.info(f"Synced nonce for {self.address}: {self._next}")
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_nonce_manager(web3, chain_id, address) -> NonceManager:
+    """
+    Returns the shared nonce manager of `address` on `chain_id`.
+    """
+    key = (chain_id, address.lower())
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = NonceManager(web3, address)
+        return manager
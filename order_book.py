@@ -0,0 +1,168 @@
+import logging
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+ORDER_FIELDS = ("ID", "Amount", "RemAmount", "Price", "Side", "Type")
+
+
+class _Side:
+    """
+    Resting orders of one market side: order dicts per price level and the sorted prices.
+    """
+    __slots__ = ("levels", "prices")
+
+    def __init__(self):
+        self.levels = {}
+        self.prices = []
+
+    def add(self, order):
+        level = self.levels.get(order["Price"])
+        if level is None:
+            level = self.levels[order["Price"]] = {}
+            insort(self.prices, order["Price"])
+        level[order["ID"]] = order
+
+    def remove(self, order):
+        level = self.levels.get(order["Price"])
+        if level is None:
+            return
+        level.pop(order["ID"], None)
+        if not level:
+            del self.levels[order["Price"]]
+            del self.prices[bisect_left(self.prices, order["Price"])]
+
+
+class OrderBook:
+    """
+    In-memory book of our own resting orders.
+    Orders are indexed by ID and by market, side and price level, and are updated
+    incrementally from the `OrderAlteration` messages the node sends back (replies to our
+    own orders as well as pushes). An order with RemAmount 0 leaves the book.
+    """
+
+    def __init__(self, user_id=None):
+        self.user_id = user_id
+        self._orders = {}
+        self._markets = defaultdict(lambda: defaultdict(_Side))
+        self._callbacks = []
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id):
+        return str(order_id).lower() in self._orders
+
+    def get(self, order_id) -> dict:
+        return self._orders.get(str(order_id).lower())
+
+    def orders(self, market_id, side=None) -> list:
+        """
+        Returns our resting orders in a market, by side and then by ascending price.
+        """
+        market = self._markets.get(market_id)
+        if market is None:
+            return []
+        sides = (side,) if side is not None else sorted(market)
+        return [
+            order
+            for s in sides if s in market
+            for price in market[s].prices
+            for order in market[s].levels[price].values()
+        ]
+
+    def level(self, market_id, side, price) -> list:
+        market = self._markets.get(market_id)
+        if market is None or side not in market:
+            return []
+        return list(market[side].levels.get(price, {}).values())
+
+    def prices(self, market_id, side) -> list:
+        market = self._markets.get(market_id)
+        if market is None or side not in market:
+            return []
+        return list(market[side].prices)
+
+    def markets(self) -> list:
+        return list(self._markets)
+
+    def on_change(self, callback):
+        """
+        Registers `callback(order)`, called after an order is added, updated or removed.
+        Removed orders are reported with RemAmount 0.
+        """
+        self._callbacks.append(callback)
+
+    def apply(self, order_data):
+        """
+        Applies one OrderAlteration payload (UnmatchedOrder plus UserOrder.MarketID).
+        """
+        unmatched = order_data.get("UnmatchedOrder")
+        if not unmatched or not unmatched.get("ID"):
+            return
+        user_id = order_data.get("UserID")
+        if self.user_id is not None and user_id is not None and str(user_id) != str(self.user_id):
+            return
+        order_id = str(unmatched["ID"]).lower()
+        previous = self._orders.get(order_id)
+        market_id = (order_data.get("UserOrder") or {}).get("MarketID")
+        if market_id is None and previous is not None:
+            market_id = previous["MarketID"]
+
+        order = dict(previous) if previous is not None else {"ID": order_id, "MarketID": market_id}
+        for field in ORDER_FIELDS[1:]:
+            if field in unmatched:
+                order[field] = unmatched[field]
+        order["MarketID"] = market_id
+        # Canonical payloads drop zero fields, so a missing RemAmount means nothing is left
+        order["RemAmount"] = unmatched.get("RemAmount") or 0
+
+        if previous is not None:
+            self._remove(previous)
+        if order["RemAmount"] > 0 and order.get("Price") is not None and order.get("Side") is not None:
+            self._orders[order_id] = order
+            self._markets[market_id][order["Side"]].add(order)
+        else:
+            order["RemAmount"] = 0
+            if previous is None:
+                return
+
+        for callback in self._callbacks:
+            try:
+                callback(order)
+            except Exception as e:
+                logging.error(f"Error in order book callback: {e}")
+
+    def on_message(self, message):
+        """
+        Session listener for `OrderAlteration` messages.
+        """
+        if message.get("State") not in (None, "OK"):
+            return
+        data = message.get("Data")
+        for order_data in data if isinstance(data, list) else (data,):
+            if isinstance(order_data, dict):
+                self.apply(order_data)
+
+    def _remove(self, order):
+        del self._orders[order["ID"]]
+        market = self._markets[order["MarketID"]]
+        market[order["Side"]].remove(order)
+        if not market[order["Side"]].levels:
+            del market[order["Side"]]
+            if not market:
+                del self._markets[order["MarketID"]]
+
+
+_books = {}
+
+
+def get_order_book(session, user_id=None) -> OrderBook:
+    """
+    Returns the order book of `user_id`, fed by every OrderAlteration message of the session.
+    """
+    key = (session, str(user_id))
+    book = _books.get(key)
+    if book is None:
+        book = _books[key] = OrderBook(user_id)
+        session.add_listener("OrderAlteration", book.on_message)
+    return book
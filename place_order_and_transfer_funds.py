@@ -1,13 +1,17 @@
 import os
 import time
-import json
 import logging
 import asyncio
-import websockets
-from web3 import Web3
+import uuid
 from eth_account import Account
-from eth_account.messages import encode_defunct
-from utils import hex_to_base64, unix_to_ticks, check_environment_variables
+from utils import unix_to_ticks, check_environment_variables
+from session import get_session, close_sessions
+from balances import get_balance_cache
+from risk import RiskGate
+from order_book import get_order_book
+from requote import RequoteEngine
+from canonical import canonical_dumps
+from signing import SigningService
 
 # Configure logging
 logging.basicConfig(
@@ -26,10 +30,9 @@ except Exception as e:
 # Wallet Config
 PRIVATE_KEY = os.getenv("PRIVATE_KEY")
 USER_ID = os.getenv("USER_ID")
+NODE_ID = os.getenv("NODE_ID")
 NODE_URL = os.getenv("NODE_URL")
-RPC_ENDPOINT = os.getenv("RPC_ENDPOINT")
 
-web3 = Web3(Web3.HTTPProvider(RPC_ENDPOINT))
 try:
     account = Account.from_key(PRIVATE_KEY)
     logging.info("Account initialized successfully.")
@@ -37,103 +40,295 @@ except Exception as e:
     logging.error(f"Failed to initialize account: {e}")
     exit(1)
 
+signer = SigningService(PRIVATE_KEY)
+
 # Operation Config
 maker_order_id = "9099a901-9180-4869-afb7-e1cc88c2c169"
 market_id = "6904d2c0-72c1-4f6b-987f-6843f4b19663"
 amount = 1.392  # 0.01 mWBTC
 price = 1.359   # Decimal odds
 side = 1        # 1 = Buy, 2 = Sell
+currency_id = 2  # WBTC, index into CURRENCY_IDS of the balance subscription
+
+def build_order_data(market_id, side, price, amount, order_id):
+    return {
+        "CreatedByUser": unix_to_ticks(int(time.time() * 1000)),
+        "MinerFeeStr": "0.00001",
+        "UnmatchedOrder": {
+            "Amount": amount,
+            "ID": order_id,
+            "Price": price,
+            "RemAmount": amount,
+            "Side": side,
+            "Type": 2
+        },
+        "UserID": USER_ID,
+        "UserOrder": {
+            "MarketID": market_id
+        }
+    }
+
+
+def sign_order_data(order_data):
+    return signer.sign(canonical_dumps(order_data, "OrderAlteration"))
+
+
+_risk_gate = None
+
+
+async def get_risk_gate() -> RiskGate:
+    """
+    Returns the pre-trade risk gate, backed by the cached balance subscription.
+    Its open-order exposure follows our order book as the node confirms, fills or
+    cancels orders.
+    """
+    global _risk_gate
+    balances = await get_balance_cache(NODE_URL, USER_ID, NODE_ID)
+    if _risk_gate is None or _risk_gate.balances is not balances:
+        _risk_gate = RiskGate(balances, currency_id)
+        get_order_book(balances.session, USER_ID).on_change(_risk_gate.track)
+    return _risk_gate
+
+
+def is_rejected(response):
+    return response.get("State") not in (None, "OK")
+
+
+def restore_exposure(risk, order_id):
+    """
+    Resets the exposure of an order whose alteration never took effect to whatever
+    our order book still holds, so a resting order that failed to amend stays counted.
+    """
+    order = get_order_book(risk.balances.session, USER_ID).get(order_id)
+    if order is not None:
+        risk.track(order)
+    else:
+        risk.release(order_id)
+
 
 async def place_order():
     try:
         logging.info("Will place an order on Bitcoin betting.")
 
-        # ATTENTION: Make sure that all parameters are in alphabetical order.
-        order_data = {
-            "CreatedByUser": unix_to_ticks(int(time.time() * 1000)),
-            "MinerFeeStr": "0.00001",
-            "UnmatchedOrder": {
-                "Amount": amount,
-                "ID": maker_order_id,
-                "Price": price,
-                "RemAmount": amount,
-                "Side": side,
-                "Type": 2
-            },
-            "UserID": USER_ID,
-            "UserOrder": {
-                "MarketID": market_id
-            }
-        }
-
-        # Sign the message
-        message = json.dumps(order_data)
-        signature = web3.eth.account.sign_message(
-            encode_defunct(text=message), private_key=PRIVATE_KEY
-        ).signature
+        order_data = build_order_data(market_id, side, price, amount, maker_order_id)
+        # Reject orders the account cannot fund before signing them
+        risk = await get_risk_gate()
+        risk.check(order_data)
 
         # Prepare WebSocket message
         ws_message = {
             "Type": "OrderAlteration",
-            "SignatureUser": hex_to_base64(signature.hex()),
+            "SignatureUser": sign_order_data(order_data),
             "Data": order_data
         }
 
-        # Connect to WebSocket and send message
-        async with websockets.connect(NODE_URL) as ws:
-            await ws.send(json.dumps(ws_message))
-            async for msg in ws:
-                response = json.loads(msg)
-                if response.get("Type") == "OrderAlteration":
-                    logging.info(f"Order Placement Status: {response}")
-                    break
+        # Send through the shared node session and wait for the reply
+        session = await get_session(NODE_URL)
+        try:
+            response = await session.request(ws_message)
+        except Exception:
+            restore_exposure(risk, maker_order_id)
+            raise
+        if is_rejected(response):
+            restore_exposure(risk, maker_order_id)
+        logging.info(f"Order Placement Status: {response}")
     except Exception as e:
         logging.error(f"Error in place_order: {e}")
         raise
 
 
+async def place_orders(orders, max_in_flight=200, batch_size=256, risk_check=True):
+    """
+    Places many orders over the shared node session.
+    Each order is a dict with market_id, side, price, amount and an optional id.
+    Batches of `batch_size` orders are signed in the signing pool while the previous
+    batch is on the wire, with at most `max_in_flight` orders awaiting their reply.
+    With `risk_check`, orders that fail the pre-trade check are not sent at all.
+    Returns (acks, summary) where acks holds one {"ID", "Response" | "Error", "Latency"}
+    entry per order, in input order; orders stopped by the risk check get
+    {"ID", "Error", "RiskRejected"} instead. Throughput and latencies in the summary
+    only cover the orders that were sent.
+    """
+    logging.info(f"Will place {len(orders)} orders on Bitcoin betting.")
+    session = await get_session(NODE_URL)
+    risk = await get_risk_gate() if risk_check else None
+    in_flight = asyncio.Semaphore(max_in_flight)
+    acks = [None] * len(orders)
+
+    async def send(index, ws_message):
+        order_id = ws_message["Data"]["UnmatchedOrder"]["ID"]
+        sent_at = time.perf_counter()
+        try:
+            response = await session.request(ws_message)
+            acks[index] = {"ID": order_id, "Response": response}
+            if risk is not None and is_rejected(response):
+                restore_exposure(risk, order_id)
+        except Exception as e:
+            acks[index] = {"ID": order_id, "Error": str(e)}
+            if risk is not None:
+                restore_exposure(risk, order_id)
+        finally:
+            acks[index]["Latency"] = time.perf_counter() - sent_at
+            in_flight.release()
+
+    def sign_batch(start):
+        batch = []
+        for index, order in enumerate(orders[start:start + batch_size], start):
+            order_data = build_order_data(
+                order["market_id"], order["side"], order["price"], order["amount"],
+                order.get("id") or str(uuid.uuid4())
+            )
+            if risk is not None:
+                try:
+                    risk.check(order_data)
+                except ValueError as e:
+                    acks[index] = {"ID": order_data["UnmatchedOrder"]["ID"], "Error": str(e), "RiskRejected": True}
+                    continue
+            batch.append((index, order_data))
+        signing = asyncio.ensure_future(signer.sign_batch([canonical_dumps(data, "OrderAlteration") for _, data in batch]))
+        return batch, signing
+
+    started = time.perf_counter()
+    tasks = []
+    next_batch = sign_batch(0) if orders else None
+    for start in range(0, len(orders), batch_size):
+        batch, signing = next_batch
+        signatures = await signing
+        # Start signing the next batch before this one goes out
+        if start + batch_size < len(orders):
+            next_batch = sign_batch(start + batch_size)
+
+        for (index, order_data), signature in zip(batch, signatures):
+            await in_flight.acquire()
+            tasks.append(asyncio.create_task(send(index, {
+                "Type": "OrderAlteration",
+                "SignatureUser": signature,
+                "Data": order_data
+            })))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    sent = [ack for ack in acks if not ack.get("RiskRejected")]
+    latencies = sorted(ack["Latency"] for ack in sent)
+    summary = {
+        "orders": len(sent),
+        "failed": sum(1 for ack in sent if "Error" in ack),
+        "risk_rejected": len(acks) - len(sent),
+        "elapsed": elapsed,
+        "orders_per_second": len(sent) / elapsed if elapsed else 0.0,
+        "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+        "latency_p99": latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+        "latency_max": latencies[-1] if latencies else 0.0,
+    }
+    logging.info(f"Order placement summary: {summary}")
+    return acks, summary
+
+
+_requote_engine = None
+
+
+async def requote_market(market_id, targets):
+    """
+    Moves our resting orders in a market to `targets` (dicts with side, price, amount and
+    an optional id), sending only the orders that changed.
+    """
+    global _requote_engine
+    risk = await get_risk_gate()
+    if _requote_engine is None or _requote_engine.risk is not risk:
+        session = risk.balances.session
+        _requote_engine = RequoteEngine(session, get_order_book(session, USER_ID), signer, build_order_data, risk)
+    return await _requote_engine.requote(market_id, targets)
+
+
+def build_transfer_data(from_id, to_id, amount, transfer_id, user_id=None, node_id=None):
+    return {
+        "Amount": amount,
+        "CreatedByUser": unix_to_ticks(int(time.time() * 1000)),
+        "From": from_id,
+        "ID": transfer_id,
+        "MinerFeeStr": "0.00001",
+        "NodeID": node_id if node_id is not None else int(NODE_ID),
+        "To": to_id,
+        "UserID": user_id if user_id is not None else int(USER_ID),
+    }
+
+
 async def make_transfer():
     try:
         logging.info("Will make a transfer on Bitcoin betting.")
 
-        # ATTENTION: Make sure that all parameters are in alphabetical order.
-        order_data = {
-            "Amount": 0.01,
-            "CreatedByUser": unix_to_ticks(int(time.time() * 1000)),
-            "From": 9,
-            "ID": maker_order_id,
-            "MinerFeeStr": "0.00001",
-            "NodeID": 102,
-            "To": 12,
-            "UserID": 9,
-        }
+        order_data = build_transfer_data(9, 12, 0.01, str(uuid.uuid4()), user_id=9, node_id=102)
 
         # Sign the message
-        message = json.dumps(order_data,separators=(',', ':'))
+        message = canonical_dumps(order_data, "Transfer")
 
         logging.info(message)
-        signature = web3.eth.account.sign_message(
-            encode_defunct(text=message), private_key=PRIVATE_KEY
-        ).signature
 
         # Prepare WebSocket message
         ws_message = {
             "Type": "Transfer",
-            "SignatureUser": hex_to_base64(signature.hex()),
+            "SignatureUser": signer.sign(message),
             "Data": order_data
         }
 
-        # Connect to WebSocket and send message
-        async with websockets.connect(NODE_URL) as ws:
-            await ws.send(json.dumps(ws_message))
-            async for msg in ws:
-                response = json.loads(msg)
-                if response.get("Type") == "Transfer":
-                    logging.info(f"Transfer Status: {response}")
-                    break
+        # Send through the shared node session and wait for the reply
+        session = await get_session(NODE_URL)
+        response = await session.request(ws_message)
+        logging.info(f"Transfer Status: {response}")
     except Exception as e:
-        logging.error(f"Error in place_order: {e}")
+        logging.error(f"Error in make_transfer: {e}")
         raise
 
+
+async def transfer_many(transfers, max_in_flight=50):
+    """
+    Sends many internal transfers over the shared node session.
+    Each transfer is a dict with from, to, amount and an optional id (a new UUID otherwise).
+    All transfers are signed in one batch and at most `max_in_flight` await their reply.
+    Returns one {"ID", "From", "To", "Amount", "Status", "Response" | "Error"} entry per
+    transfer, in input order; Status is the node's State, or "Error" if no reply came.
+    """
+    logging.info(f"Will make {len(transfers)} transfers on Bitcoin betting.")
+    session = await get_session(NODE_URL)
+    in_flight = asyncio.Semaphore(max_in_flight)
+
+    batch = [
+        build_transfer_data(transfer["from"], transfer["to"], transfer["amount"], transfer.get("id") or str(uuid.uuid4()))
+        for transfer in transfers
+    ]
+    signatures = await signer.sign_batch([canonical_dumps(data, "Transfer") for data in batch])
+
+    async def send(transfer_data, signature):
+        status = {key: transfer_data[key] for key in ("ID", "From", "To", "Amount")}
+        async with in_flight:
+            try:
+                response = await session.request({
+                    "Type": "Transfer",
+                    "SignatureUser": signature,
+                    "Data": transfer_data
+                })
+                status.update(Status=response.get("State"), Response=response)
+            except Exception as e:
+                logging.error(f"Transfer {transfer_data['ID']} failed: {e}")
+                status.update(Status="Error", Error=str(e))
+        return status
+
+    statuses = await asyncio.gather(*[send(data, signature) for data, signature in zip(batch, signatures)])
+    failed = sum(1 for status in statuses if status["Status"] != "OK")
+    logging.info(f"Transfers done: {len(statuses) - failed} OK, {failed} failed")
+    return statuses
+
+
+async def main():
+    try:
+        await place_order()
+    finally:
+        signer.close()
+        await close_sessions()
+
+
 if __name__ == "__main__":
-    asyncio.run(place_order())
+    try:
+        asyncio.run(main())
+    except Exception as e:
+        logging.error(f"Unhandled error: {e}")
@@ -0,0 +1,55 @@
+import os
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class WorkerPool:
+    """
+    Process (or thread, when `use_processes` is False) pool of `workers` shared by the
+    CPU-bound services. `map_chunks` splits a batch into one chunk per worker and
+    gathers the results without blocking the event loop. The pool is started lazily
+    with `initializer(*initargs)` in every worker.
+    """
+
+    def __init__(self, workers=None, use_processes=True, initializer=None, initargs=()):
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        self._initializer = initializer
+        self._initargs = initargs
+        self._executor = None
+
+    async def map_chunks(self, function, items) -> list:
+        """
+        Runs `function(chunk)` for every chunk of `items` in the pool and returns the
+        flattened results in the same order.
+        """
+        if not items:
+            return []
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        size = -(-len(items) // self.workers)
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        results = await asyncio.gather(*[
+            loop.run_in_executor(executor, function, chunk) for chunk in chunks
+        ])
+        return [result for chunk in results for result in chunk]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get_executor(self):
+        # Created lazily so that importing a script does not start a pool
+        if self._executor is None:
+            pool = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+            self._executor = pool(
+                max_workers=self.workers, initializer=self._initializer, initargs=self._initargs
+            )
+        return self._executor
@@ -0,0 +1,183 @@
+import time
+import asyncio
+import logging
+from collections import deque
+
+from web3._utils.method_formatters import receipt_formatter
+from web3.datastructures import AttributeDict
+
+from fees import get_fee_oracle
+
+
+def _normalize(tx_hash):
+    if not isinstance(tx_hash, str):
+        tx_hash = tx_hash.hex()
+    tx_hash = tx_hash.lower()
+    return tx_hash if tx_hash.startswith("0x") else "0x" + tx_hash
+
+
+class _Pending:
+    __slots__ = ("waiters", "block_number", "mined_at")
+
+    def __init__(self):
+        # (confirmations, future) per caller waiting on the transaction
+        self.waiters = []
+        self.block_number = None
+        self.mined_at = None
+
+    def prune(self):
+        self.waiters = [(confirmations, future) for confirmations, future in self.waiters if not future.done()]
+        return self.waiters
+
+    @property
+    def confirmations(self):
+        return min(confirmations for confirmations, _ in self.waiters)
+
+
+class ReceiptTracker:
+    """
+    Waits for many transactions of one chain at once.
+    A single background task polls the block number; on every new block it fetches the
+    receipts of all transactions that are not mined yet or deep enough in one batched
+    RPC call, and resolves each transaction with that receipt once it is
+    `confirmations` blocks deep. The time between seeing a transaction mined and
+    resolving it is kept in `latencies`.
+    """
+
+    def __init__(self, web3, confirmations=1, poll_interval=2.0):
+        self.web3 = web3
+        self.confirmations = confirmations
+        self.poll_interval = poll_interval
+        self.latencies = deque(maxlen=1000)
+        self._pending = {}
+        self._block_listeners = []
+        self._head = None
+        self._has_new = False
+        self._task = None
+
+    def on_block(self, callback):
+        """
+        Registers `callback(block_number)`, called whenever a new block is seen.
+        """
+        self._block_listeners.append(callback)
+
+    def track(self, tx_hash, confirmations=None) -> asyncio.Future:
+        """
+        Starts tracking a transaction and returns a future that resolves to its receipt
+        once it is `confirmations` deep. Every call gets its own future, so callers
+        waiting on the same transaction can ask for different depths and give up
+        independently.
+        """
+        tx_hash = _normalize(tx_hash)
+        pending = self._pending.get(tx_hash)
+        if pending is None:
+            pending = self._pending[tx_hash] = _Pending()
+            self._has_new = True
+        future = asyncio.get_running_loop().create_future()
+        pending.waiters.append((confirmations or self.confirmations, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return future
+
+    def untrack(self, tx_hash, future):
+        """
+        Stops waiting with `future`; the transaction is dropped once nobody waits on it.
+        """
+        tx_hash = _normalize(tx_hash)
+        if not future.done():
+            future.cancel()
+        pending = self._pending.get(tx_hash)
+        if pending is not None and not pending.prune():
+            del self._pending[tx_hash]
+
+    async def wait(self, tx_hash, timeout=120, confirmations=None):
+        """
+        Drop-in replacement for `wait_for_transaction_receipt`.
+        """
+        future = self.track(tx_hash, confirmations)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Transaction {_normalize(tx_hash)} was not confirmed after {timeout} seconds.")
+        finally:
+            self.untrack(tx_hash, future)
+
+    async def _run(self):
+        while self._pending:
+            try:
+                head = await self.web3.eth.block_number
+                if self._head is None or head > self._head:
+                    self._head = head
+                    for callback in self._block_listeners:
+                        callback(head)
+                elif not self._has_new:
+                    head = None
+                if head is not None:
+                    # Newly tracked transactions may already be mined, check them right away
+                    self._has_new = False
+                    await self._poll(head)
+            except Exception as e:
+                logging.warning(f"Receipt polling failed: {e}")
+            if self._pending:
+                await asyncio.sleep(self.poll_interval)
+
+    async def _poll(self, head):
+        for tx_hash in [tx_hash for tx_hash, pending in self._pending.items() if not pending.prune()]:
+            del self._pending[tx_hash]
+        # Receipts of transactions not mined yet, and of those deep enough to resolve,
+        # which are fetched again in case a reorg moved or dropped them
+        checked = [
+            tx_hash for tx_hash, pending in self._pending.items()
+            if pending.block_number is None or head - pending.block_number + 1 >= pending.confirmations
+        ]
+        if not checked:
+            return
+        # Raw batch: the formatted web3 batch raises as soon as one receipt is missing
+        responses = await self.web3.provider.make_batch_request(
+            [("eth_getTransactionReceipt", [tx_hash]) for tx_hash in checked]
+        )
+        responses = sorted(responses, key=lambda response: response["id"])
+        now = time.monotonic()
+        for tx_hash, response in zip(checked, responses):
+            pending = self._pending.get(tx_hash)
+            if pending is None:
+                continue
+            if "error" in response:
+                raise ValueError(f"Fetching receipt of {tx_hash} failed: {response['error']}")
+            receipt = response.get("result")
+            if not receipt:
+                # Not mined yet, or dropped by a reorg: look for it again on the next block
+                pending.block_number = None
+                continue
+            receipt = AttributeDict.recursive(receipt_formatter(receipt))
+            if pending.block_number is None:
+                pending.mined_at = now
+            pending.block_number = receipt["blockNumber"]
+            depth = head - receipt["blockNumber"] + 1
+            if depth < pending.confirmations:
+                continue
+
+            latency = now - pending.mined_at
+            for confirmations, future in pending.waiters:
+                if confirmations <= depth and not future.done():
+                    future.set_result(receipt)
+                    self.latencies.append(latency)
+            logging.info(f"Transaction {tx_hash} confirmed in block {receipt['blockNumber']}, "
+                         f"{latency:.1f}s after it was mined.")
+            if not pending.prune():
+                del self._pending[tx_hash]
+
+
+_trackers = {}
+
+
+def get_receipt_tracker(web3, chain_id, confirmations=1) -> ReceiptTracker:
+    """
+    Returns the shared receipt tracker of `chain_id`.
+    New blocks it sees also refresh the chain's fee oracle.
+    """
+    tracker = _trackers.get(chain_id)
+    if tracker is None:
+        tracker = _trackers[chain_id] = ReceiptTracker(web3, confirmations)
+        tracker.on_block(get_fee_oracle(web3, chain_id).observe_block)
+    return tracker
@@ -0,0 +1,319 @@
+import os
+import csv
+import sys
+import logging
+from itertools import groupby
+from decimal import Decimal
+from indexer import connect
+from utils import CURRENCIES_DATA, ticks_to_unix
+from deposit_watcher import NATIVE_CURRENCY_IDS
+
+# Rows moved between SQLite and Python at a time; memory use is bounded by this, not by the data size
+FETCH_SIZE = 10000
+
+
+def currency_table(chain_id):
+    """
+    Returns (currency_id, token address or "", decimals, native) for the currencies of a chain.
+    """
+    native_id = NATIVE_CURRENCY_IDS.get(chain_id)
+    rows = [(native_id, "", 18, 1)] if native_id is not None else []
+    for index, currency in enumerate(CURRENCIES_DATA):
+        if currency.get("contract") and index != native_id:
+            rows.append((index, currency["contract"].lower(), currency["decimals"], 0))
+    return rows
+
+
+def platform_to_units(amount, decimals, native):
+    """
+    Converts a platform amount (claims, balances) to on-chain units: native coins are kept
+    in milli units on the platform (mETH, mRBTC), tokens in whole units.
+    """
+    units = Decimal(str(amount)) * 10 ** decimals
+    return int(units / 1000 if native else units)
+
+
+def burn_to_units(amount, decimals):
+    # Burn validations carry milli units for every currency, see withdraw.py
+    return int(Decimal(str(amount)) * 10 ** decimals / 1000)
+
+
+def _stream(cursor):
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def merge_join(left, right, left_key, right_key):
+    """
+    Sort-merge join of two iterables sorted by their keys. Yields (key, left_rows,
+    right_rows) for every key on either side, holding only one key's rows in memory.
+    """
+    left, right = iter(left), iter(right)
+    left_row, right_row = next(left, None), next(right, None)
+    while left_row is not None or right_row is not None:
+        if right_row is None or (left_row is not None and left_key(left_row) < right_key(right_row)):
+            key = left_key(left_row)
+        else:
+            key = right_key(right_row)
+        left_rows, right_rows = [], []
+        while left_row is not None and left_key(left_row) == key:
+            left_rows.append(left_row)
+            left_row = next(left, None)
+        while right_row is not None and right_key(right_row) == key:
+            right_rows.append(right_row)
+            right_row = next(right, None)
+        yield key, left_rows, right_rows
+
+
+class Reconciler:
+    """
+    Checks the indexed chain events of one chain against what the platform reports.
+    Platform data is loaded into temporary tables next to the index: claimed deposit
+    hashes, pending burn validations, per-user ledger snapshots and the user of each
+    address. Every check streams both sides from SQLite sorted on the join key (SQLite
+    sorts through its indexes or on disk) and merges them in one pass.
+    """
+
+    def __init__(self, db, chain_id):
+        self.db = db
+        self.chain_id = chain_id
+        # Let large sorts spill to disk instead of memory
+        db.execute("PRAGMA temp_store=FILE")
+        db.executescript("""
+            CREATE TEMP TABLE IF NOT EXISTS claims (chain_id INTEGER, tx_hash TEXT, PRIMARY KEY (chain_id, tx_hash));
+            CREATE TEMP TABLE IF NOT EXISTS burns (
+                txid TEXT PRIMARY KEY, account TEXT, token TEXT, amount TEXT, currency_id INTEGER, created INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS temp.burns_key ON burns (account, token, amount, created);
+            CREATE TEMP TABLE IF NOT EXISTS ledger (
+                user_id TEXT, currency_id INTEGER, balance TEXT, deposited TEXT, withdrawn TEXT, pnl TEXT,
+                PRIMARY KEY (user_id, currency_id)
+            );
+            CREATE TEMP TABLE IF NOT EXISTS accounts (address TEXT PRIMARY KEY, user_id TEXT);
+            CREATE TEMP TABLE IF NOT EXISTS currencies (
+                currency_id INTEGER, token TEXT PRIMARY KEY, decimals INTEGER, native INTEGER
+            );
+        """)
+        with db:
+            db.execute("DELETE FROM currencies")
+            db.executemany("INSERT INTO currencies VALUES (?, ?, ?, ?)", currency_table(chain_id))
+        self._currencies = {row[0]: row for row in currency_table(chain_id)}
+
+    def _load(self, sql, rows):
+        batch = []
+        with self.db:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= FETCH_SIZE:
+                    self.db.executemany(sql, batch)
+                    batch = []
+            self.db.executemany(sql, batch)
+
+    def load_claims(self, claims):
+        """
+        Loads the (chain ID, tx hash) pairs of deposits the platform has credited
+        (CurrencyIssuance). Only the claims of this chain are checked.
+        """
+        self._load("INSERT OR IGNORE INTO claims VALUES (?, ?)",
+                   ((int(chain_id), tx_hash.lower()) for chain_id, tx_hash in claims))
+
+    def load_burn_validations(self, burn_validations):
+        """
+        Loads pending burn validations (GetBurnValidations records: TXID, Address, Cur, Amount
+        and, if known, CreatedByUser in .NET ticks as set on the withdraw request).
+        """
+        def rows():
+            for burn_validation in burn_validations:
+                currency = self._currencies.get(int(burn_validation["Cur"]))
+                if currency is None:
+                    continue
+                currency_id, token, decimals, _ = currency
+                created = burn_validation.get("CreatedByUser")
+                yield (
+                    str(burn_validation["TXID"]).lower(),
+                    str(burn_validation["Address"]).lower(),
+                    token,
+                    str(burn_to_units(burn_validation["Amount"], decimals)),
+                    currency_id,
+                    # Unix seconds, like the block timestamps of the indexed events
+                    ticks_to_unix(int(created)) // 1000 if created not in (None, "") else None,
+                )
+        self._load("INSERT OR IGNORE INTO burns VALUES (?, ?, ?, ?, ?, ?)", rows())
+
+    def load_ledger(self, snapshots):
+        """
+        Loads platform balance snapshots: dicts with user_id, currency_id, balance and, if
+        the platform reports them, the deposited and withdrawn totals and the trading P&L
+        (pnl) of the currency (platform units).
+        """
+        def rows():
+            for snapshot in snapshots:
+                currency = self._currencies.get(int(snapshot["currency_id"]))
+                if currency is None:
+                    continue
+                _, _, decimals, native = currency
+                totals = [
+                    str(platform_to_units(snapshot[field], decimals, native)) if snapshot.get(field) not in (None, "") else None
+                    for field in ("balance", "deposited", "withdrawn", "pnl")
+                ]
+                yield (str(int(snapshot["user_id"])), int(snapshot["currency_id"]), *totals)
+        self._load("INSERT OR REPLACE INTO ledger VALUES (?, ?, ?, ?, ?, ?)", rows())
+
+    def load_accounts(self, accounts):
+        """
+        Loads (address, user_id) pairs, used for events that carry no user ID.
+        User IDs are kept as decimal text, like in the index, since they can exceed 64 bits.
+        """
+        self._load("INSERT OR REPLACE INTO accounts VALUES (?, ?)",
+                   ((address.lower(), str(int(user_id))) for address, user_id in accounts))
+
+    def unclaimed_deposits(self):
+        """
+        Yields deposits found on chain but never credited, and credited hashes with no
+        deposit on chain.
+        """
+        events = self.db.execute(
+            "SELECT tx_hash, block_number, event, account, user_id, token, amount FROM events "
+            "WHERE chain_id = ? AND event IN ('Deposited', 'ERC20Deposited') ORDER BY tx_hash",
+            (self.chain_id,)
+        )
+        claims = self.db.execute("SELECT tx_hash FROM claims WHERE chain_id = ? ORDER BY tx_hash", (self.chain_id,))
+        for tx_hash, deposits, claimed in merge_join(_stream(events), _stream(claims), lambda r: r[0], lambda r: r[0]):
+            if not claimed:
+                for _, block_number, event, account, user_id, token, amount in deposits:
+                    yield {"issue": "unclaimed_deposit", "tx_hash": tx_hash, "block_number": block_number,
+                           "event": event, "account": account, "user_id": user_id, "token": token, "amount": amount}
+            elif not deposits:
+                yield {"issue": "claim_without_deposit", "tx_hash": tx_hash}
+
+    def unexecuted_burns(self):
+        """
+        Yields burn validations with no matching withdrawal on chain. Withdraw events carry
+        no TXID, so they are matched on (receiver, token, amount), one event per validation.
+        A validation with a creation time is only settled by an event mined after it, so
+        an old withdrawal of the same amount does not hide a new one.
+        """
+        withdrawals = self.db.execute(
+            "SELECT account, COALESCE(token, ''), amount, timestamp FROM events "
+            "WHERE chain_id = ? AND event IN ('Withdraw', 'ERC20Withdraw') ORDER BY 1, 2, 3, 4",
+            (self.chain_id,)
+        )
+        burns = self.db.execute(
+            "SELECT account, token, amount, txid, currency_id, created FROM burns ORDER BY 1, 2, 3, COALESCE(created, 0)"
+        )
+        for _, validations, executed in merge_join(_stream(burns), _stream(withdrawals), lambda r: r[:3], lambda r: r[:3]):
+            # Each event settles the oldest validation created before it; earlier events are
+            # executions of older burns
+            settled, eligible = 0, 0
+            for _, _, _, timestamp in executed:
+                while eligible < len(validations) and (validations[eligible][5] or 0) <= timestamp:
+                    eligible += 1
+                if settled < eligible:
+                    settled += 1
+            for account, token, amount, txid, currency_id, _ in validations[settled:]:
+                yield {"issue": "unexecuted_burn", "txid": txid, "account": account, "currency_id": currency_id,
+                       "amount": amount}
+
+    def _flows(self):
+        # Events attributed to a user, through the event itself or the accounts table
+        return self.db.execute(
+            "SELECT COALESCE(e.user_id, a.user_id) AS user, c.currency_id, e.event, e.amount "
+            "FROM events e "
+            "JOIN currencies c ON c.token = COALESCE(e.token, '') "
+            "LEFT JOIN accounts a ON a.address = e.account "
+            "WHERE e.chain_id = ? AND COALESCE(e.user_id, a.user_id) IS NOT NULL "
+            "ORDER BY 1, 2",
+            (self.chain_id,)
+        )
+
+    def _totals(self):
+        # One running (deposited, withdrawn) total per user and currency at a time
+        for (user_id, currency_id), rows in groupby(_stream(self._flows()), lambda r: r[:2]):
+            rows = list(rows)
+            deposited = sum(int(amount) for _, _, event, amount in rows if event.endswith("Deposited"))
+            withdrawn = sum(int(amount) for _, _, event, amount in rows if event.endswith("Withdraw"))
+            yield user_id, currency_id, deposited, withdrawn
+
+    def balance_mismatches(self):
+        """
+        Compares per-user, per-currency on-chain deposit and withdrawal totals with the
+        platform ledger, and the balance with deposited - withdrawn + pnl where the ledger
+        has a P&L. Yields users with chain activity missing from the ledger, totals that
+        differ from what the platform reports (amounts in on-chain units), and ledger rows
+        with none of those fields to compare.
+        """
+        ledger = self.db.execute(
+            "SELECT user_id, currency_id, balance, deposited, withdrawn, pnl FROM ledger ORDER BY 1, 2"
+        )
+        not_compared = 0
+        for (user_id, currency_id), chain, platform in merge_join(
+            self._totals(), _stream(ledger), lambda r: r[:2], lambda r: r[:2]
+        ):
+            deposited, withdrawn = (chain[0][2], chain[0][3]) if chain else (0, 0)
+            if not platform:
+                yield {"issue": "missing_from_ledger", "user_id": user_id, "currency_id": currency_id,
+                       "chain_deposited": deposited, "chain_withdrawn": withdrawn}
+                continue
+            _, _, balance, platform_deposited, platform_withdrawn, pnl = platform[0]
+            # (platform value, value expected from the chain) for every field the ledger has
+            checks = [(platform_deposited, deposited), (platform_withdrawn, withdrawn)]
+            expected_balance = None
+            if pnl is not None and balance is not None:
+                expected_balance = deposited - withdrawn + int(pnl)
+                checks.append((balance, expected_balance))
+            checks = [(platform_value, chain_value) for platform_value, chain_value in checks if platform_value is not None]
+            if not checks:
+                not_compared += 1
+                yield {"issue": "not_compared", "user_id": user_id, "currency_id": currency_id,
+                       "chain_deposited": deposited, "chain_withdrawn": withdrawn, "platform_balance": balance}
+                continue
+            if any(int(platform_value) != chain_value for platform_value, chain_value in checks):
+                yield {"issue": "mismatch", "user_id": user_id, "currency_id": currency_id,
+                       "chain_deposited": deposited, "chain_withdrawn": withdrawn,
+                       "platform_deposited": platform_deposited, "platform_withdrawn": platform_withdrawn,
+                       "platform_balance": balance, "expected_balance": expected_balance}
+        if not_compared:
+            logging.warning(f"{not_compared} ledger rows have no deposited, withdrawn or pnl field, "
+                            f"their balances were not checked")
+
+    def report(self):
+        """
+        Yields every finding of all checks.
+        """
+        yield from self.unclaimed_deposits()
+        yield from self.unexecuted_burns()
+        yield from self.balance_mismatches()
+
+
+def read_csv(path):
+    if not path:
+        return
+    with open(path, newline="") as f:
+        yield from csv.DictReader(f)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler()]
+    )
+    # CSV inputs: claims (chain_id, tx_hash), burns (TXID, Address, Cur, Amount[, CreatedByUser]),
+    # ledger (user_id, currency_id, balance[, deposited, withdrawn, pnl]), accounts (address, user_id)
+    reconciler = Reconciler(connect(os.getenv("INDEX_DB", "events.db")), int(os.getenv("CHAIN_ID", 30)))
+    reconciler.load_claims((row["chain_id"], row["tx_hash"]) for row in read_csv(os.getenv("RECONCILE_CLAIMS")))
+    reconciler.load_burn_validations(read_csv(os.getenv("RECONCILE_BURNS")))
+    reconciler.load_ledger(read_csv(os.getenv("RECONCILE_LEDGER")))
+    reconciler.load_accounts((row["address"], row["user_id"]) for row in read_csv(os.getenv("RECONCILE_ACCOUNTS")))
+
+    counts = {}
+    writer = None
+    for finding in reconciler.report():
+        counts[finding["issue"]] = counts.get(finding["issue"], 0) + 1
+        if writer is None:
+            writer = csv.writer(sys.stdout)
+        writer.writerow([finding["issue"], *(f"{key}={value}" for key, value in finding.items() if key != "issue")])
+    logging.info(f"Reconciliation findings: {counts or 'none'}")
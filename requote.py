@@ -0,0 +1,165 @@
+import time
+import uuid
+import asyncio
+import logging
+
+from canonical import canonical_dumps
+
+
+def diff_orders(resting, targets, amount_tolerance=1e-9):
+    """
+    Diffs the target quotes of one market against our resting orders in it.
+    Targets are dicts with side, price, amount and an optional id. A target with an id
+    amends that order; otherwise it keeps a resting order of the same side and price, or
+    amends another leftover order of that side, or becomes a new order. Resting orders no
+    target claims are cancelled.
+    Returns (new, amend, cancel, unchanged): new and amend hold (order_id, target) pairs,
+    cancel and unchanged hold resting orders.
+    """
+    by_id = {order["ID"]: order for order in resting}
+    new, amend, unchanged = [], [], []
+    free = []
+
+    for target in targets:
+        order_id = str(target["id"]).lower() if target.get("id") else None
+        if order_id is not None:
+            order = by_id.pop(order_id, None)
+            if order is None:
+                new.append((order_id, target))
+            elif order["Side"] == target["side"] and order["Price"] == target["price"] \
+                    and abs(order["RemAmount"] - target["amount"]) <= amount_tolerance:
+                unchanged.append(order)
+            else:
+                amend.append((order_id, target))
+        else:
+            free.append(target)
+
+    # Exact price matches first, so orders keep their place in the queue where possible
+    leftovers = []
+    by_level = {}
+    for order in by_id.values():
+        by_level.setdefault((order["Side"], order["Price"]), []).append(order)
+    for target in free:
+        level = by_level.get((target["side"], target["price"]))
+        if level:
+            order = level.pop()
+            if abs(order["RemAmount"] - target["amount"]) <= amount_tolerance:
+                unchanged.append(order)
+            else:
+                amend.append((order["ID"], target))
+        else:
+            leftovers.append(target)
+
+    remaining = {}
+    for level in by_level.values():
+        for order in level:
+            remaining.setdefault(order["Side"], []).append(order)
+    for target in leftovers:
+        side = remaining.get(target["side"])
+        if side:
+            amend.append((side.pop()["ID"], target))
+        else:
+            new.append((str(uuid.uuid4()), target))
+
+    cancel = [order for side in remaining.values() for order in side]
+    return new, amend, cancel, unchanged
+
+
+class RequoteEngine:
+    """
+    Moves our resting orders in a market to a target set of quotes with as few
+    OrderAlteration messages as possible.
+    Resting orders come from the order book; only new, changed and cancelled orders are
+    signed and sent, so messages and signing work scale with how much the quotes moved.
+    `build_order(market_id, side, price, amount, order_id)` returns an OrderAlteration
+    payload and `risk`, if given, is a RiskGate that new and amended orders must pass.
+    """
+
+    def __init__(self, session, book, signer, build_order, risk=None, amount_tolerance=1e-9):
+        self.session = session
+        self.book = book
+        self.signer = signer
+        self.build_order = build_order
+        self.risk = risk
+        self.amount_tolerance = amount_tolerance
+        self._locks = {}
+
+    async def requote(self, market_id, targets) -> dict:
+        """
+        Sends the alterations that turn our resting orders in `market_id` into `targets`
+        and waits for the node's replies. Returns a summary with the count of each kind of
+        change and the acks of the messages sent.
+        """
+        # One requote per market at a time: the next one must see the book this one leaves
+        lock = self._locks.get(market_id)
+        if lock is None:
+            lock = self._locks[market_id] = asyncio.Lock()
+        async with lock:
+            started = time.perf_counter()
+            new, amend, cancel, unchanged = diff_orders(
+                self.book.orders(market_id), targets, self.amount_tolerance
+            )
+
+            payloads = []
+            rejected = []
+            for order_id, target in new + amend:
+                order_data = self.build_order(market_id, target["side"], target["price"], target["amount"], order_id)
+                if self.risk is not None:
+                    try:
+                        self.risk.check(order_data)
+                    except ValueError as e:
+                        logging.warning(f"Requote of {order_id} rejected: {e}")
+                        rejected.append(order_id)
+                        continue
+                payloads.append(order_data)
+            for order in cancel:
+                order_data = self.build_order(market_id, order["Side"], order["Price"], order["Amount"], order["ID"])
+                order_data["UnmatchedOrder"]["RemAmount"] = 0
+                payloads.append(order_data)
+
+            signatures = await self.signer.sign_batch(
+                [canonical_dumps(order_data, "OrderAlteration") for order_data in payloads]
+            )
+            acks = await asyncio.gather(*[
+                self._send(order_data, signature) for order_data, signature in zip(payloads, signatures)
+            ])
+
+            summary = {
+                "new": len(new),
+                "amended": len(amend),
+                "cancelled": len(cancel),
+                "unchanged": len(unchanged),
+                "rejected": len(rejected),
+                "failed": sum(1 for ack in acks if "Error" in ack),
+                "elapsed": time.perf_counter() - started,
+                "acks": acks,
+            }
+            logging.info(f"Requoted market {market_id}: {len(new)} new, {len(amend)} amended, "
+                         f"{len(cancel)} cancelled, {len(unchanged)} unchanged, {len(rejected)} rejected")
+            return summary
+
+    async def _send(self, order_data, signature):
+        order_id = order_data["UnmatchedOrder"]["ID"]
+        try:
+            response = await self.session.request({
+                "Type": "OrderAlteration",
+                "SignatureUser": signature,
+                "Data": order_data
+            })
+        except Exception as e:
+            if self.risk is not None:
+                self._restore(order_id)
+            return {"ID": order_id, "Error": str(e)}
+        if response.get("State") not in (None, "OK"):
+            if self.risk is not None:
+                self._restore(order_id)
+            return {"ID": order_id, "Error": response.get("State"), "Response": response}
+        return {"ID": order_id, "Response": response}
+
+    def _restore(self, order_id):
+        # The alteration never took effect, so the exposure is whatever the book still holds
+        order = self.book.get(order_id)
+        if order is not None:
+            self.risk.track(order)
+        else:
+            self.risk.release(order_id)
@@ -0,0 +1,93 @@
+import math
+import logging
+
+BUY = 1
+SELL = 2
+
+
+def liability(side, price, amount) -> float:
+    """
+    Returns what an order can lose at most: the stake for a Buy (back),
+    the stake times (price - 1) for a Sell (lay).
+    """
+    if side == BUY:
+        return amount
+    if side == SELL:
+        return amount * (price - 1)
+    raise ValueError(f"Unknown order side: {side}")
+
+
+class RiskGate:
+    """
+    Pre-trade check run before an order is signed.
+    An order passes if its liability fits in the cached available balance of the currency
+    minus the liability of our own open orders. Orders that do not fit are rejected, or
+    shrunk to what still fits when `resize` is set. Everything is local state, so a
+    check costs microseconds instead of a round trip to the node.
+    """
+
+    def __init__(self, balances, currency_id, resize=False, amount_decimals=8):
+        self.balances = balances
+        self.currency_id = currency_id
+        self.resize = resize
+        self.amount_decimals = amount_decimals
+        self._exposure = {}
+        self._total = 0.0
+
+    @property
+    def exposure(self) -> float:
+        return self._total
+
+    def headroom(self) -> float:
+        return self.balances.available(self.currency_id) - self._total
+
+    def check(self, order_data) -> dict:
+        """
+        Checks an OrderAlteration payload and reserves its liability.
+        Returns the payload (resized in place if needed) or raises ValueError.
+        """
+        order = order_data["UnmatchedOrder"]
+        side, price, rem_amount = order["Side"], order["Price"], order["RemAmount"]
+        if price <= 1:
+            raise ValueError(f"Invalid price {price} for order {order['ID']}")
+        required = liability(side, price, rem_amount)
+        # An amended order replaces the exposure of its previous version
+        headroom = self.headroom() + self._exposure.get(str(order["ID"]).lower(), 0.0)
+
+        if required > headroom:
+            if not self.resize:
+                raise ValueError(f"Order {order['ID']} needs {required} but only {headroom} is available")
+            fitting = headroom if side == BUY else headroom / (price - 1)
+            scale = 10 ** self.amount_decimals
+            fitting = math.floor(fitting * scale) / scale
+            if fitting <= 0:
+                raise ValueError(f"Order {order['ID']} needs {required} but only {headroom} is available")
+            logging.info(f"Resizing order {order['ID']} from {rem_amount} to {fitting}")
+            order["Amount"] = round(order["Amount"] - (rem_amount - fitting), self.amount_decimals)
+            order["RemAmount"] = fitting
+            required = liability(side, price, fitting)
+
+        self._set(order["ID"], required)
+        return order_data
+
+    def track(self, order):
+        """
+        Updates the exposure of an order from an `UnmatchedOrder` record, e.g. after a fill.
+        """
+        rem_amount = order.get("RemAmount") or 0
+        self._set(order["ID"], liability(order["Side"], order["Price"], rem_amount) if rem_amount > 0 else 0.0)
+
+    def release(self, order_id):
+        """
+        Drops the exposure of an order that was rejected, cancelled or filled.
+        """
+        self._set(order_id, 0.0)
+
+    def _set(self, order_id, value):
+        order_id = str(order_id).lower()
+        self._total += value - self._exposure.pop(order_id, 0.0)
+        if value > 0:
+            self._exposure[order_id] = value
+        if not self._exposure:
+            # Avoid float drift once nothing is open
+            self._total = 0.0
@@ -0,0 +1,216 @@
+import json
+import asyncio
+import logging
+from collections import defaultdict, OrderedDict
+
+import websockets
+
+# Where each message type carries the ID that ties a reply to its request
+REQUEST_KEY_PATHS = {
+    "OrderAlteration": (("UnmatchedOrder", "ID"),),
+    "Transfer": (("ID",),),
+    "CurrencyIssuance": (("Deposit", "TXID"),),
+}
+
+
+def message_key(message):
+    """
+    Returns the order/transfer/deposit ID of a request or reply, or None if it has none.
+    """
+    data = message.get("Data")
+    if isinstance(data, dict):
+        for path in REQUEST_KEY_PATHS.get(message.get("Type"), ()):
+            value = data
+            for field in path:
+                value = value.get(field) if isinstance(value, dict) else None
+            if value is not None:
+                return str(value).lower()
+    key = message.get("ID")
+    return str(key).lower() if key is not None else None
+
+
+class NodeSession:
+    """
+    Long-lived WebSocket connection to the Bitcoin Betting node.
+    Every operation sends through the same socket and many requests can be in flight
+    at once; a single reader task hands each reply back to the caller waiting for it,
+    matched by the request ID (see `message_key`). Requests without an ID are sent one
+    at a time per Type, so their reply is always the one for the request in flight.
+    Subscriptions receive every message of their Type and are renewed after a reconnect.
+    """
+
+    def __init__(self, url, request_timeout=30):
+        self.url = url
+        self.request_timeout = request_timeout
+        self._ws = None
+        self._reader = None
+        self._loop = None
+        self._connect_lock = None
+        self._pending = defaultdict(OrderedDict)
+        self._keyless_locks = {}
+        self._listeners = defaultdict(list)
+        self._subscriptions = []
+        self._closing = False
+
+    @property
+    def is_open(self):
+        return self._ws is not None and self._ws.open
+
+    async def connect(self):
+        if self._connect_lock is None:
+            self._loop = asyncio.get_running_loop()
+            self._connect_lock = asyncio.Lock()
+
+        async with self._connect_lock:
+            if self.is_open:
+                return
+            self._ws = await websockets.connect(self.url, max_size=None)
+            self._reader = asyncio.create_task(self._read_loop(self._ws))
+            logging.info(f"Connected to node {self.url}")
+            for message in self._subscriptions:
+                await self._ws.send(json.dumps(message, separators=(',', ':')))
+
+    async def send(self, message):
+        await self.connect()
+        await self._ws.send(json.dumps(message, separators=(',', ':')))
+
+    async def request(self, message, timeout=None):
+        """
+        Sends a message and waits for the reply carrying the same ID.
+        """
+        key = message_key(message)
+        if key is None:
+            # Replies can't be told apart, so only one such request of a Type is in flight
+            lock = self._keyless_locks.get(message["Type"])
+            if lock is None:
+                lock = self._keyless_locks[message["Type"]] = asyncio.Lock()
+            async with lock:
+                return await self._request(message, object(), timeout)
+        if key in self._pending[message["Type"]]:
+            raise ValueError(f"A {message['Type']} request with ID {key} is already in flight.")
+        return await self._request(message, key, timeout)
+
+    async def _request(self, message, key, timeout):
+        waiters = self._pending[message["Type"]]
+        future = asyncio.get_running_loop().create_future()
+        waiters[key] = future
+        try:
+            await self.send(message)
+            return await asyncio.wait_for(future, timeout or self.request_timeout)
+        finally:
+            if waiters.get(key) is future:
+                del waiters[key]
+
+    async def subscribe(self, message, callback):
+        """
+        Sends a subscription message and calls `callback(message)` for every message of
+        the same Type from then on, replies to other requests included.
+        """
+        self.add_listener(message["Type"], callback)
+        self._subscriptions.append(message)
+        await self.send(message)
+
+    def unsubscribe(self, message, callback):
+        """
+        Stops calling `callback` and no longer re-sends `message` after a reconnect.
+        """
+        listeners = self._listeners.get(message["Type"], [])
+        if callback in listeners:
+            listeners.remove(callback)
+        if message in self._subscriptions:
+            self._subscriptions.remove(message)
+
+    def add_listener(self, message_type, callback):
+        """
+        Calls `callback(message)` for every message of `message_type`, without sending anything.
+        """
+        self._listeners[message_type].append(callback)
+
+    async def close(self):
+        self._closing = True
+        if self._ws is not None:
+            await self._ws.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+    def _dispatch(self, response):
+        message_type = response.get("Type")
+        listeners = self._listeners.get(message_type)
+        for callback in listeners or ():
+            try:
+                callback(response)
+            except Exception as e:
+                logging.error(f"Error in {message_type} listener: {e}")
+
+        waiters = self._pending.get(message_type)
+        if waiters:
+            key = message_key(response)
+            if key is not None:
+                future = waiters.pop(key, None)
+            else:
+                # Replies without an ID go to the one request of that Type in flight
+                future = waiters.popitem(last=False)[1]
+            if future is not None:
+                if not future.done():
+                    future.set_result(response)
+                return
+        if not listeners:
+            logging.debug(f"Unsolicited node message: {response}")
+
+    async def _reconnect(self):
+        delay = 1
+        while not self._closing and not self.is_open:
+            try:
+                await self.connect()
+            except Exception as e:
+                logging.warning(f"Reconnecting to node failed: {e}, retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    async def _read_loop(self, ws):
+        error = None
+        try:
+            async for raw in ws:
+                try:
+                    response = json.loads(raw)
+                except ValueError:
+                    logging.warning(f"Ignoring malformed node message: {raw!r}")
+                    continue
+                self._dispatch(response)
+        except Exception as e:
+            error = e
+        finally:
+            error = ConnectionError(f"Node connection closed: {error or ws.close_code}")
+            for waiters in self._pending.values():
+                while waiters:
+                    future = waiters.popitem(last=False)[1]
+                    if not future.done():
+                        future.set_exception(error)
+            # Subscriptions only stay alive if the connection comes back by itself
+            if self._subscriptions and not self._closing:
+                logging.warning(f"{error}, reconnecting.")
+                asyncio.ensure_future(self._reconnect())
+
+
+_sessions = {}
+
+
+async def get_session(url):
+    """
+    Returns the shared session for `url`, connecting it on first use.
+    A new session is created when the previous one belongs to a finished event loop.
+    """
+    session = _sessions.get(url)
+    if session is None or session._loop not in (None, asyncio.get_running_loop()):
+        session = NodeSession(url)
+        _sessions[url] = session
+    await session.connect()
+    return session
+
+
+async def close_sessions():
+    sessions = list(_sessions.values())
+    _sessions.clear()
+    for session in sessions:
+        if session._loop is asyncio.get_running_loop():
+            await session.close()
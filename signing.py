@@ -0,0 +1,52 @@
+import base64
+
+from eth_account import Account
+from eth_account.messages import encode_defunct
+
+from pool import WorkerPool
+
+# Account used by the pool workers, set once per worker by _init_worker
+_worker_account = None
+
+
+def _init_worker(private_key):
+    global _worker_account
+    _worker_account = Account.from_key(private_key)
+
+
+def _sign(account, message):
+    signature = account.sign_message(encode_defunct(text=message)).signature
+    return base64.b64encode(signature).decode('utf-8')
+
+
+def _sign_chunk(messages):
+    return [_sign(_worker_account, message) for message in messages]
+
+
+class SigningService(WorkerPool):
+    """
+    Signs node payloads with the user's key and returns the Base64 signatures
+    the node expects (the same value as `hex_to_base64(signature.hex())`).
+    Batches are split across a pool of `workers` processes, or threads when
+    `use_processes` is False, so that signing does not block the event loop.
+    """
+
+    def __init__(self, private_key, workers=None, use_processes=True):
+        super().__init__(workers, use_processes, initializer=_init_worker, initargs=(private_key,))
+        self.private_key = private_key
+        self._account = Account.from_key(private_key)
+
+    def sign(self, message: str) -> str:
+        """
+        Signs a single message inline, for callers that are not latency sensitive.
+        """
+        return _sign(self._account, message)
+
+    async def sign_async(self, message: str) -> str:
+        return (await self.sign_batch([message]))[0]
+
+    async def sign_batch(self, messages) -> list:
+        """
+        Signs all messages in the pool and returns their signatures in the same order.
+        """
+        return await self.map_chunks(_sign_chunk, messages)
@@ -1,4 +1,8 @@
 import os
+import time
+import logging
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 import base64
 
@@ -396,6 +400,12 @@ ERC20_ABI = [
     }
 ]
 
+# ABI with the Deposited/ERC20Deposited/Withdraw/ERC20Withdraw events of the main contract,
+# per chain ID. BB_ABI (Ethereum) has no event definitions, so only RSK can be watched.
+EVENT_ABIS = {
+    30: BB_RSK_ABI,
+}
+
 CURRENCIES_DATA = [
     {"id": 0, "decimals": 18, "contract": ''},
     {"id": 1, "decimals": 18},
@@ -406,6 +416,9 @@ CURRENCIES_DATA = [
 def unix_to_ticks(unix: int) -> int:
     return unix * 10000 + 621355968000000000
 
+def ticks_to_unix(ticks: int) -> int:
+    return (ticks - 621355968000000000) // 10000
+
 def hex_to_base64(hex_str: str) -> str:
     binary = bytes.fromhex(hex_str)
     return base64.b64encode(binary).decode('utf-8')
@@ -422,15 +435,57 @@ def check_environment_variables():
             raise EnvironmentError(f"{var} environment variable not found.")
 
 
-def get_dynamic_gas(transaction):
+# Gas estimate cache, keyed by (chain ID, contract address, function selector)
+GAS_CACHE_SIZE = 256
+GAS_CACHE_TTL = 600  # seconds before an estimate is considered stale
+GAS_BUFFER = 1.2
+FALLBACK_GAS = 300000
+
+_gas_cache = OrderedDict()
+_gas_cache_lock = threading.Lock()
+
+
+def _gas_cache_key(function, transaction):
+    return transaction.get("chainId"), function.address, function.selector
+
+
+async def get_dynamic_gas(function, transaction, estimate=True):
     """
-    Estimates the gas required for a transaction dynamically.
-    Falls back to a default value if estimation fails.
+    Returns a gas limit (estimate plus buffer) for calling a contract function.
+    Estimates are cached per chain, contract and function, so the node is only asked
+    when the cache is cold, stale or the function last ran out of gas.
+    Falls back to a default value if estimation fails, or right away without `estimate`
+    (for calls that depend on a transaction that is not mined yet).
     """
+    key = _gas_cache_key(function, transaction)
+    with _gas_cache_lock:
+        cached = _gas_cache.get(key)
+        if cached is not None and time.monotonic() - cached[1] < GAS_CACHE_TTL:
+            _gas_cache.move_to_end(key)
+            return cached[0]
+    if not estimate:
+        return cached[0] if cached is not None else FALLBACK_GAS
+
     try:
-        estimated_gas = web3.eth.estimate_gas(transaction)
-        buffer_gas = int(estimated_gas * 1.2)
-        return buffer_gas
+        estimate_params = {k: transaction[k] for k in ("from", "value") if k in transaction}
+        buffer_gas = int(await function.estimate_gas(estimate_params) * GAS_BUFFER)
     except Exception as e:
         logging.error(f"Gas estimation failed: {e}, using fallback gas limit.")
-        return 300000
\ No newline at end of file
+        return FALLBACK_GAS
+
+    with _gas_cache_lock:
+        _gas_cache[key] = (buffer_gas, time.monotonic())
+        _gas_cache.move_to_end(key)
+        while len(_gas_cache) > GAS_CACHE_SIZE:
+            _gas_cache.popitem(last=False)
+    return buffer_gas
+
+
+def check_gas_used(function, transaction, receipt):
+    """
+    Drops the cached estimate of a function whose transaction ran out of gas.
+    """
+    if receipt["status"] == 0 and receipt["gasUsed"] >= transaction["gas"]:
+        logging.warning(f"Transaction ran out of gas, re-estimating {function.fn_name} next time.")
+        with _gas_cache_lock:
+            _gas_cache.pop(_gas_cache_key(function, transaction), None)
@@ -0,0 +1,75 @@
+import base64
+
+from eth_abi.packed import encode_packed
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from eth_utils import keccak
+
+from pool import WorkerPool
+
+
+def _to_bytes(value):
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    value = str(value)
+    try:
+        return bytes.fromhex(value[2:] if value.startswith("0x") else value)
+    except ValueError:
+        # The node hands out some signatures in Base64
+        return base64.b64decode(value)
+
+
+def withdraw_digest(types, values) -> bytes:
+    """
+    Returns keccak256 of the tightly packed withdraw arguments, as the contract hashes them.
+    """
+    values = [_to_bytes(value) if abi_type.startswith("bytes") else value for abi_type, value in zip(types, values)]
+    return keccak(encode_packed(types, values))
+
+
+def _recover(types, values, signature):
+    try:
+        message = encode_defunct(primitive=withdraw_digest(types, values))
+        return Account.recover_message(message, signature=_to_bytes(signature)).lower()
+    except Exception:
+        return None
+
+
+def _recover_chunk(items):
+    return [_recover(*item) for item in items]
+
+
+class SignatureVerifier(WorkerPool):
+    """
+    Checks validator signatures of withdrawals locally before anything is broadcast.
+    Each item is (types, values, signature): the withdraw arguments the validator signed
+    with their Solidity types, and the signature. The signer is recovered from the
+    Ethereum signed-message hash of the packed arguments and must be one of `validators`.
+    Batches are spread over a pool of `workers` processes (threads if `use_processes` is
+    False); batches smaller than `inline_below` are checked inline.
+    """
+
+    def __init__(self, validators, workers=None, use_processes=True, inline_below=16):
+        super().__init__(workers, use_processes)
+        self.validators = {address.lower() for address in validators}
+        self.inline_below = inline_below
+
+    def recover(self, types, values, signature):
+        """
+        Returns the lower-cased address that signed the arguments, or None if it can't be recovered.
+        """
+        return _recover(types, values, signature)
+
+    def verify(self, types, values, signature) -> bool:
+        return self.recover(types, values, signature) in self.validators
+
+    async def recover_batch(self, items) -> list:
+        """
+        Recovers the signers of all items in the pool, in the same order.
+        """
+        if len(items) < self.inline_below:
+            return _recover_chunk(items)
+        return await self.map_chunks(_recover_chunk, items)
+
+    async def verify_batch(self, items) -> list:
+        return [signer in self.validators for signer in await self.recover_batch(items)]
@@ -1,15 +1,21 @@
 import os
 import time
-import json
 import logging
 import asyncio
-import websockets
 import uuid
-from web3 import Web3
+from web3 import AsyncWeb3
 from eth_account import Account
-from eth_account.messages import encode_defunct
-from utils import unix_to_ticks, hex_to_base64, BB_ABI, BB_CONTRACT_ADDRESS, CURRENCIES_DATA, \
+from utils import unix_to_ticks, BB_ABI, BB_CONTRACT_ADDRESS, CURRENCIES_DATA, \
     check_environment_variables
+from session import get_session, close_sessions
+from canonical import canonical_dumps
+from nonces import get_nonce_manager
+from fees import get_fee_oracle
+from receipts import get_receipt_tracker
+from withdrawals import fetch_burn_validations, verify_withdrawals, BurnValidationAggregator, BurnValidationWatcher, \
+    WithdrawalProcessor
+from verification import SignatureVerifier
+from signing import SigningService
 
 # Configure logging
 logging.basicConfig(
@@ -30,9 +36,11 @@ PRIVATE_KEY = os.getenv("PRIVATE_KEY")
 USER_ID = os.getenv("USER_ID")
 NODE_ID = os.getenv("NODE_ID")
 NODE_URL = os.getenv("NODE_URL")
+# Comma-separated validator addresses; withdrawals are only verified locally when set
+VALIDATOR_ADDRESSES = [address for address in os.getenv("VALIDATOR_ADDRESSES", "").split(",") if address]
 RPC_ENDPOINT = "https://eth.llamarpc.com"
 
-web3 = Web3(Web3.HTTPProvider(RPC_ENDPOINT))
+web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(RPC_ENDPOINT))
 try:
     account = Account.from_key(PRIVATE_KEY)
     logging.info("Account initialized successfully.")
@@ -40,7 +48,14 @@ except Exception as e:
     logging.error(f"Failed to initialize account: {e}")
     exit(1)
 
+signer = SigningService(PRIVATE_KEY)
+
+nonces = get_nonce_manager(web3, 1, account.address)
+fees = get_fee_oracle(web3, 1)
+receipts = get_receipt_tracker(web3, 1)
+
 main_contract = web3.eth.contract(address=BB_CONTRACT_ADDRESS, abi=BB_ABI)
+verifier = SignatureVerifier(VALIDATOR_ADDRESSES) if VALIDATOR_ADDRESSES else None
 
 # Operation Configuration
 amount = 20  # 0.1 mETH
@@ -53,17 +68,18 @@ async def reset_limit():
 
         main_contract = web3.eth.contract(address=BB_CONTRACT_ADDRESS, abi=BB_ABI)
 
-        transaction = main_contract.functions.resetWithdrawalLimit().build_transaction({
-            'chainId': 1,
-            'gas': 300000,
-            'gasPrice': web3.to_wei('10', 'gwei'),
-            'nonce': web3.eth.get_transaction_count(account.address)
-        })
+        async with nonces.reserve() as nonce:
+            transaction = await main_contract.functions.resetWithdrawalLimit().build_transaction({
+                'chainId': 1,
+                'gas': 300000,
+                **await fees.fee_params(),
+                'nonce': nonce
+            })
 
-        signed_tx = web3.eth.account.sign_transaction(transaction, private_key=PRIVATE_KEY)
-        tx_hash = web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            signed_tx = web3.eth.account.sign_transaction(transaction, private_key=PRIVATE_KEY)
+            tx_hash = await web3.eth.send_raw_transaction(signed_tx.raw_transaction)
         logging.info(f"reset transaction sent, hash: {web3.to_hex(tx_hash)}")
-        receipt = web3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
+        receipt = await receipts.wait(tx_hash, timeout=120)
         logging.info("reset transaction confirmed: %s", receipt)
         return web3.to_hex(tx_hash)
     except Exception as e:
@@ -73,8 +89,6 @@ async def reset_limit():
 async def request_withdraw():
     try:
         logging.info("Will request a withdraw on Bitcoin Betting.")
-        # ATTENTION: Make sure that all parameters are in alphabetical order.
-        # ATTENTION: Remove empty string and zeroed number values.
         withdraw_data = {
             "Amount": amount,
             "CreatedByUser": unix_to_ticks(int(time.time() * 1000)),
@@ -88,103 +102,160 @@ async def request_withdraw():
             "UserID": USER_ID
         }
 
-        # Sign the message
-        message = json.dumps(withdraw_data)
-        signature = web3.eth.account.sign_message(
-            encode_defunct(text=message), private_key=PRIVATE_KEY
-        ).signature
+        # Sign the message in the signing pool
+        signature = await signer.sign_async(canonical_dumps(withdraw_data, "Transfer"))
 
         # Prepare WebSocket message
         ws_message = {
             "Type": "Transfer",
-            "SignatureUser": hex_to_base64(signature.hex()),
+            "SignatureUser": signature,
             "Data": withdraw_data,
             "UserID": USER_ID
         }
 
-        # Connect to WebSocket and send the message
-        async with websockets.connect(NODE_URL) as ws:
-            await ws.send(json.dumps(ws_message))
-            async for msg in ws:
-                response = json.loads(msg)
-                if response.get("Type") == "Transfer":
-                    logging.info(f"Withdraw request status: {response['State']}")
-                    return response
+        # Send through the shared node session and wait for the reply
+        session = await get_session(NODE_URL)
+        response = await session.request(ws_message)
+        logging.info(f"Withdraw request status: {response['State']}")
+        return response
     except Exception as e:
         logging.error(f"Error in request_withdraw: {e}")
         raise
 
 
+def withdraw_arguments(burn_validation):
+    """
+    Returns the contract function name, Solidity types and values of a withdrawal, without
+    the validator signature: withdraw for ETH, withdrawERC for tokens.
+    """
+    if burn_validation["Cur"] == "1":  # ETH Withdraw
+        amount_eth = web3.to_wei(burn_validation["Amount"] / 1000, "ether")
+        return "withdraw", ("uint256", "uint256", "address", "uint8", "bytes32"), (
+            amount_eth,
+            int(burn_validation["Nonce"]),
+            account.address,
+            1,
+            f"0x{burn_validation['TXID']}"
+        )
+    # ERC20 Withdraw
+    amount_unit = int(
+        burn_validation["Amount"] / 1000
+        * (10 ** CURRENCIES_DATA[burn_validation["Cur"]]["decimals"])
+    )
+    return "withdrawERC", ("uint256", "uint256", "address", "uint8", "address", "bytes32"), (
+        amount_unit,
+        int(burn_validation["Nonce"]),
+        CURRENCIES_DATA[burn_validation["Cur"]]["contract"],
+        CURRENCIES_DATA[burn_validation["Cur"]]["id"],
+        account.address,
+        f"0x{burn_validation['TXID']}"
+    )
+
+
+def signed_arguments(burn_validation):
+    _, types, values = withdraw_arguments(burn_validation)
+    return types, values
+
+
+def withdraw_function(burn_validation):
+    """
+    Returns the withdraw (ETH) or withdrawERC (tokens) contract call for a burn validation.
+    """
+    name, _, values = withdraw_arguments(burn_validation)
+    return main_contract.functions[name](*values, burn_validation["SignatureValidator"])
+
+
 async def send_withdraw():
     try:
-        async with websockets.connect(NODE_URL) as ws:
-            message = {
-                "Type": "GetBurnValidations",
-                "Data": {
-                    "MaxResults": 1,
-                    "NodeID": NODE_ID,
-                    "UserID": USER_ID
-                }
+        message = {
+            "Type": "GetBurnValidations",
+            "Data": {
+                "MaxResults": 1,
+                "NodeID": NODE_ID,
+                "UserID": USER_ID
             }
+        }
 
-            # Send message to fetch burn validations
-            await ws.send(json.dumps(message))
-            async for msg in ws:
-                response = json.loads(msg)
-                if response.get("Type") == "GetBurnValidations":
-                    logging.info(f"Withdraw request status: {response}")
-                    burn_validation = response["Data"][0]
-                    if burn_validation["Cur"] == "1":  # ETH Withdraw
-                        amount_eth = web3.to_wei(burn_validation["Amount"] / 1000, "ether")
-                        request = main_contract.functions.withdraw(
-                            amount_eth,
-                            int(burn_validation["Nonce"]),
-                            account.address,
-                            1,
-                            f"0x{burn_validation['TXID']}",
-                            burn_validation["SignatureValidator"]
-                        ).build_transaction({
-                            "from": account.address,
-                            "gas": 300000,
-                            "gasPrice": web3.to_wei("20", "gwei"),
-                            "nonce": web3.eth.get_transaction_count(account.address)
-                        })
-                    else:  # ERC20 Withdraw
-                        amount_unit = int(
-                            burn_validation["Amount"] / 1000
-                            * (10 ** CURRENCIES_DATA[burn_validation["Cur"]]["decimals"])
-                        )
-                        request = main_contract.functions.withdrawERC(
-                            amount_unit,
-                            int(burn_validation["Nonce"]),
-                            CURRENCIES_DATA[burn_validation["Cur"]]["contract"],
-                            CURRENCIES_DATA[burn_validation["Cur"]]["id"],
-                            account.address,
-                            f"0x{burn_validation['TXID']}",
-                            burn_validation["SignatureValidator"]
-                        ).build_transaction({
-                            "from": account.address,
-                            "gas": 300000,
-                            "gasPrice": web3.to_wei("20", "gwei"),
-                            "nonce": web3.eth.get_transaction_count(account.address)
-                        })
-
-                    # Sign and send transaction
-                    signed_tx = web3.eth.account.sign_transaction(request, PRIVATE_KEY)
-                    tx_hash = web3.eth.send_raw_transaction(signed_tx.raw_transaction)
-                    logging.info(f"Withdraw transaction monitoring: {web3.to_hex(tx_hash)}")
-                    receipt = web3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
-                    logging.info(f"Withdraw confirmed: {receipt}")
-                    break
+        # Fetch burn validations through the shared node session
+        session = await get_session(NODE_URL)
+        response = await session.request(message)
+        logging.info(f"Withdraw request status: {response}")
+        burn_validation = response["Data"][0]
+        if verifier is not None and not verifier.verify(*signed_arguments(burn_validation), burn_validation["SignatureValidator"]):
+            raise ValueError(f"Validator signature for {burn_validation['TXID']} does not verify, not sending it")
+        async with nonces.reserve() as nonce:
+            request = await withdraw_function(burn_validation).build_transaction({
+                "from": account.address,
+                "gas": 300000,
+                **await fees.fee_params(),
+                "nonce": nonce
+            })
+
+            # Sign and send transaction
+            signed_tx = web3.eth.account.sign_transaction(request, PRIVATE_KEY)
+            tx_hash = await web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        logging.info(f"Withdraw transaction monitoring: {web3.to_hex(tx_hash)}")
+        receipt = await receipts.wait(tx_hash, timeout=120)
+        logging.info(f"Withdraw confirmed: {receipt}")
     except Exception as e:
         logging.error(f"Error in send_withdraw: {e}")
         raise
 
 
+async def execute_withdrawals(ready):
+    if verifier is not None:
+        ready = await verify_withdrawals(verifier, ready, signed_arguments)
+    processor = WithdrawalProcessor(
+        web3, account, PRIVATE_KEY, nonces, fees, receipts,
+        lambda group: withdraw_function(group[0]), chain_id=1
+    )
+    return await processor.process(ready)
+
+
+async def send_withdraws(max_results=10000):
+    """
+    Executes every pending withdrawal: all burn validations are fetched (up to
+    `max_results` records), indexed by TXID and submitted back-to-back with consecutive nonces.
+    """
+    try:
+        session = await get_session(NODE_URL)
+        # On Ethereum a single validator signature is enough
+        aggregator = BurnValidationAggregator(quorum=1)
+        aggregator.extend(await fetch_burn_validations(session, USER_ID, NODE_ID, max_results=max_results))
+        return await execute_withdrawals(aggregator.take_ready())
+    except Exception as e:
+        logging.error(f"Error in send_withdraws: {e}")
+        raise
+
+
+async def watch_withdrawals(interval=5.0):
+    """
+    Executes withdrawals as soon as their burn validations arrive.
+    Polls the burn validations on the shared session every `interval` seconds until cancelled.
+    """
+    session = await get_session(NODE_URL)
+    watcher = BurnValidationWatcher(
+        session, USER_ID, NODE_ID, BurnValidationAggregator(quorum=1), execute_withdrawals, interval=interval,
+        receipts=receipts
+    )
+    try:
+        await watcher.start()
+    finally:
+        await watcher.stop()
+
+
+async def main():
+    try:
+        await reset_limit()
+        #await request_withdraw()
+        #await send_withdraw()
+    finally:
+        signer.close()
+        await close_sessions()
+
+
 if __name__ == "__main__":
     try:        
-        asyncio.run(reset_limit())
-        #asyncio.run(request_withdraw())
-        #asyncio.run(send_withdraw())
+        asyncio.run(main())
     except Exception as e:
         logging.error(f"Unhandled error: {e}")
@@ -1,15 +1,21 @@
 import os
 import time
-import json
 import logging
 import asyncio
-import websockets
 import uuid
-from web3 import Web3
+from web3 import AsyncWeb3
 from eth_account import Account
-from eth_account.messages import encode_defunct
-from utils import unix_to_ticks, hex_to_base64, BB_RSK_ABI, BB_CONTRACT_ADDRESS, CURRENCIES_DATA, \
+from utils import unix_to_ticks, BB_RSK_ABI, BB_CONTRACT_ADDRESS, CURRENCIES_DATA, \
     check_environment_variables
+from session import get_session, close_sessions
+from canonical import canonical_dumps
+from nonces import get_nonce_manager
+from fees import get_fee_oracle
+from receipts import get_receipt_tracker
+from withdrawals import fetch_burn_validations, verify_withdrawals, BurnValidationAggregator, BurnValidationWatcher, \
+    WithdrawalProcessor
+from verification import SignatureVerifier
+from signing import SigningService
 
 # Configure logging
 logging.basicConfig(
@@ -30,9 +36,11 @@ PRIVATE_KEY = os.getenv("PRIVATE_KEY")
 USER_ID = int(os.getenv("USER_ID"))
 NODE_ID = int(os.getenv("NODE_ID"))
 NODE_URL = os.getenv("NODE_URL")
+# Comma-separated validator addresses; withdrawals are only verified locally when set
+VALIDATOR_ADDRESSES = [address for address in os.getenv("VALIDATOR_ADDRESSES", "").split(",") if address]
 RPC_ENDPOINT = "https://eth.llamarpc.com"
 
-web3 = Web3(Web3.HTTPProvider(RPC_ENDPOINT))
+web3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(RPC_ENDPOINT))
 try:
     account = Account.from_key(PRIVATE_KEY)
     logging.info("Account initialized successfully.")
@@ -40,32 +48,39 @@ except Exception as e:
     logging.error(f"Failed to initialize account: {e}")
     exit(1)
 
-main_contract = web3.eth.contract(address=BB_CONTRACT_ADDRESS, abi=BB_ABI)
+signer = SigningService(PRIVATE_KEY)
+
+main_contract = web3.eth.contract(address=BB_CONTRACT_ADDRESS, abi=BB_RSK_ABI)
+verifier = SignatureVerifier(VALIDATOR_ADDRESSES) if VALIDATOR_ADDRESSES else None
 
 # Operation Configuration
 amount = 0.05  # 0.1 mETH
 currency_id = 5  # Currency ID: 'mBTC' = 0, 'mETH' = 1, 'WBTC' = 2, RBTC = 5
 chain_id = 30
+WITHDRAW_QUORUM = 2  # Validator signatures needed before a withdraw is sent
+
+nonces = get_nonce_manager(web3, chain_id, account.address)
+fees = get_fee_oracle(web3, chain_id)
+receipts = get_receipt_tracker(web3, chain_id)
 
 
 async def reset_limit():
     try:
 
-        main_contract = web3.eth.contract(address=BB_CONTRACT_ADDRESS, abi=BB_ABI)
+        main_contract = web3.eth.contract(address=BB_CONTRACT_ADDRESS, abi=BB_RSK_ABI)
 
-        gasprice = int(web3.eth.gas_price * 1.2)
-
-        transaction = main_contract.functions.resetWithdrawalLimit().build_transaction({
-            'chainId': chain_id,
-            'gas': 300000,
-            'gasPrice': gasprice,
-            'nonce': web3.eth.get_transaction_count(account.address)
-        })
+        async with nonces.reserve() as nonce:
+            transaction = await main_contract.functions.resetWithdrawalLimit().build_transaction({
+                'chainId': chain_id,
+                'gas': 300000,
+                **await fees.fee_params(),
+                'nonce': nonce
+            })
 
-        signed_tx = web3.eth.account.sign_transaction(transaction, private_key=PRIVATE_KEY)
-        tx_hash = web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            signed_tx = web3.eth.account.sign_transaction(transaction, private_key=PRIVATE_KEY)
+            tx_hash = await web3.eth.send_raw_transaction(signed_tx.raw_transaction)
         logging.info(f"reset transaction sent, hash: {web3.to_hex(tx_hash)}")
-        receipt = web3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
+        receipt = await receipts.wait(tx_hash, timeout=120)
         logging.info("reset transaction confirmed: %s", receipt)
         return web3.to_hex(tx_hash)
     except Exception as e:
@@ -75,8 +90,6 @@ async def reset_limit():
 async def request_withdraw():
     try:
         logging.info("Will request a withdraw on Bitcoin Betting.")
-        # ATTENTION: Make sure that all parameters are in alphabetical order.
-        # ATTENTION: Remove empty string and zeroed number values.
         withdraw_data = {
             "Amount": amount,
             "CreatedByUser": unix_to_ticks(int(time.time() * 1000)),
@@ -90,116 +103,159 @@ async def request_withdraw():
             "UserID": USER_ID
         }
 
-        # Sign the message
-        message = json.dumps(withdraw_data,separators=(',', ':'))
-        signature = web3.eth.account.sign_message(
-            encode_defunct(text=message), private_key=PRIVATE_KEY
-        ).signature
+        # Sign the message in the signing pool
+        signature = await signer.sign_async(canonical_dumps(withdraw_data, "Transfer"))
 
         # Prepare WebSocket message
         ws_message = {
             "Type": "Transfer",
-            "SignatureUser": hex_to_base64(signature.hex()),
+            "SignatureUser": signature,
             "Data": withdraw_data,
             "UserID": USER_ID
         }
 
-        # Connect to WebSocket and send the message
-        async with websockets.connect(NODE_URL) as ws:
-            await ws.send(json.dumps(ws_message,separators=(',', ':')))
-            async for msg in ws:
-                response = json.loads(msg)
-                if response.get("Type") == "Transfer":
-                    logging.info(f"Withdraw request status: {response['State']}")
-                    return response
+        # Send through the shared node session and wait for the reply
+        session = await get_session(NODE_URL)
+        response = await session.request(ws_message)
+        logging.info(f"Withdraw request status: {response['State']}")
+        return response
     except Exception as e:
         logging.error(f"Error in request_withdraw: {e}")
         raise
 
 
 
+def signed_arguments(burn_validation):
+    """
+    Returns the Solidity types and values of the withdraw arguments the validators sign.
+    """
+    return ("uint256", "uint256", "address", "bytes32"), (
+        web3.to_wei(burn_validation["Amount"] / 1000, "ether"),
+        int(burn_validation["Nonce"]),
+        AsyncWeb3.to_checksum_address(burn_validation["Address"]),
+        f"0x{burn_validation['TXID']}"
+    )
+
+
+def withdraw_function(burn_validations):
+    """
+    Returns the withdraw contract call for the burn validations of one TXID.
+    The contract takes three validator signatures; a missing one is filled in with
+    another validator's signature.
+    """
+    signatures = {burn_validation["ValidatorID"]: burn_validation["SignatureValidator"] for burn_validation in burn_validations}
+    fallback = next(iter(signatures.values()))
+    # The aggregator only groups records that agree on amount, nonce and address
+    _, values = signed_arguments(burn_validations[0])
+    return main_contract.functions.withdraw(
+        *values,
+        signatures.get(1, fallback),
+        signatures.get(2, fallback),
+        signatures.get(3, fallback)
+    )
+
+
+async def fetch_ready_withdrawals(max_results=10000):
+    """
+    Returns the RBTC withdrawals signed by a quorum of validators, by TXID.
+    """
+    session = await get_session(NODE_URL)
+    aggregator = BurnValidationAggregator(quorum=WITHDRAW_QUORUM)
+    aggregator.extend(
+        burn_validation for burn_validation in await fetch_burn_validations(session, USER_ID, NODE_ID, max_results=max_results)
+        if burn_validation["Cur"] == currency_id
+    )
+    for txid in aggregator.pending():
+        logging.info(f"Withdrawal {txid} is still waiting for validator signatures")
+    return await verify_ready(aggregator.take_ready())
+
+
+async def verify_ready(ready):
+    # Check every signature locally when the validator set is configured,
+    # a bad one would only show up as a reverted withdraw
+    if verifier is None:
+        return ready
+    return await verify_withdrawals(verifier, ready, signed_arguments, WITHDRAW_QUORUM)
+
+
 async def send_withdraw(txid=None):
     try:
-        async with websockets.connect(NODE_URL) as ws:
-            message = {
-                "Type": "GetBurnValidations",
-                "Data": {
-                    "MaxResults": 15,
-                    "NodeID": NODE_ID,
-                    "UserID": USER_ID
-                }
-            }
-            gasprice = int(web3.eth.gas_price * 1.2)
-
-            # Send message to fetch burn validations
-            sign1=''
-            sign2=''
-            sing3=''
-            fetchedsigns = 0
-            address_parsed = ''
-            await ws.send(json.dumps(message))
-            async for msg in ws:
-                response = json.loads(msg)
-                breakIt=False
-                if response.get("Type") == "GetBurnValidations":
-                    logging.info(f"Withdraw request status: {response}")
-                    for burn_validation in response["Data"]:
-                    #burn_validation = response["Data"][0]
-                        if burn_validation["Cur"] == currency_id:
-                            amount_rbtc = web3.to_wei(burn_validation["Amount"] / 1000, "ether")
-
-                        if burn_validation["ValidatorID"] == 1 and (burn_validation["TXID"] == txid  or txid is None):
-                            sign1 = burn_validation["SignatureValidator"]
-                            address_parsed = burn_validation["Address"]
-                            fetchedsigns  += 1
-                        if burn_validation["ValidatorID"] == 2 and (burn_validation["TXID"] == txid  or txid is None):
-                            sign2 = burn_validation["SignatureValidator"]
-                            address_parsed = burn_validation["Address"]
-                            fetchedsigns += 1
-                        if burn_validation["ValidatorID"] == 3 and (burn_validation["TXID"] == txid  or txid is None):
-                            sign3 = burn_validation["SignatureValidator"]
-                            address_parsed = burn_validation["Address"]
-                            fetchedsigns += 1
-                        if fetchedsigns==2 :
-                            breakIt=True
-                            break
-                    if breakIt:
-                        break
-            if sign1 == '':
-                sign1 = sign2
-            if sign2 =='':
-                sign2 = sign3
-            if sign3 == '':
-                sign3= sign2
-
-            request = main_contract.functions.withdraw(
-                amount_rbtc,
-                int(burn_validation["Nonce"]),
-                Web3.to_checksum_address(address_parsed),
-                f"0x{burn_validation['TXID']}",
-                sign1,
-                sign2,
-                sign3
-            ).build_transaction({
+        ready = await fetch_ready_withdrawals()
+        if txid is not None:
+            txid = txid.lower()
+        elif ready:
+            txid = next(iter(ready))
+        if txid not in ready:
+            raise ValueError(f"No withdrawal with enough validator signatures for {txid}")
+
+        async with nonces.reserve() as nonce:
+            request = await withdraw_function(ready[txid]).build_transaction({
                 "from": account.address,
                 "gas": 300000,
-                "gasPrice": gasprice,
-                "nonce": web3.eth.get_transaction_count(account.address)
+                **await fees.fee_params(),
+                "nonce": nonce
             })
             signed_tx = web3.eth.account.sign_transaction(request, PRIVATE_KEY)
-            tx_hash = web3.eth.send_raw_transaction(signed_tx.raw_transaction)
-            logging.info(f"Withdraw transaction monitoring: {web3.to_hex(tx_hash)}")
-            receipt = web3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
-            logging.info(f"Withdraw confirmed: {receipt}")
+            tx_hash = await web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        logging.info(f"Withdraw transaction monitoring: {web3.to_hex(tx_hash)}")
+        receipt = await receipts.wait(tx_hash, timeout=120)
+        logging.info(f"Withdraw confirmed: {receipt}")
     except Exception as e:
         logging.error(f"Error in send_withdraw: {e}")
         raise
 
 
+async def send_withdraws(max_results=10000):
+    """
+    Executes every pending RBTC withdrawal with a quorum of validator signatures,
+    back-to-back with consecutive nonces. At most `max_results` burn validations are fetched.
+    """
+    try:
+        processor = WithdrawalProcessor(
+            web3, account, PRIVATE_KEY, nonces, fees, receipts, withdraw_function, chain_id=chain_id
+        )
+        return await processor.process(await fetch_ready_withdrawals(max_results))
+    except Exception as e:
+        logging.error(f"Error in send_withdraws: {e}")
+        raise
+
+
+async def watch_withdrawals(interval=5.0):
+    """
+    Executes RBTC withdrawals as soon as a quorum of validators has signed them.
+    Polls the burn validations on the shared session every `interval` seconds until cancelled.
+    """
+    session = await get_session(NODE_URL)
+    processor = WithdrawalProcessor(
+        web3, account, PRIVATE_KEY, nonces, fees, receipts, withdraw_function, chain_id=chain_id
+    )
+
+    async def execute(ready):
+        return await processor.process(await verify_ready(ready))
+
+    watcher = BurnValidationWatcher(
+        session, USER_ID, NODE_ID, BurnValidationAggregator(quorum=WITHDRAW_QUORUM), execute,
+        interval=interval, accept=lambda burn_validation: burn_validation["Cur"] == currency_id,
+        receipts=receipts
+    )
+    try:
+        await watcher.start()
+    finally:
+        await watcher.stop()
+
+
+async def main():
+    try:
+        #await reset_limit()
+        await request_withdraw()
+        await send_withdraw()
+    finally:
+        signer.close()
+        await close_sessions()
+
+
 if __name__ == "__main__":
     try:        
-        #asyncio.run(reset_limit())
-        asyncio.run(request_withdraw())
-        asyncio.run(send_withdraw())
+        asyncio.run(main())
     except Exception as e:
         logging.error(f"Unhandled error: {e}")
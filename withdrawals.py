@@ -0,0 +1,416 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+
+def validation_key(burn_validation):
+    return str(burn_validation["TXID"]).lower(), burn_validation.get("ValidatorID")
+
+
+async def fetch_burn_validations(session, user_id, node_id, page_size=50, max_results=10000) -> list:
+    """
+    Fetches all pending burn validations of the user.
+    GetBurnValidations has no offset, so the window is doubled until the node returns
+    fewer records than asked for, or a page brings no (TXID, ValidatorID) not seen yet.
+    At most `max_results` records are asked for; a warning is logged when that cap is
+    reached with a full page, as more validations may be pending.
+    """
+    seen = OrderedDict()
+    limit = page_size
+    while True:
+        response = await session.request({
+            "Type": "GetBurnValidations",
+            "Data": {
+                "MaxResults": limit,
+                "NodeID": node_id,
+                "UserID": user_id
+            }
+        })
+        records = response.get("Data") or []
+        new = 0
+        for burn_validation in records:
+            key = validation_key(burn_validation)
+            if key not in seen:
+                seen[key] = burn_validation
+                new += 1
+        if len(records) < limit or not new:
+            break
+        if limit >= max_results:
+            logging.warning(f"Stopped at the cap of {max_results} burn validations, more may be pending")
+            break
+        limit = min(limit * 2, max_results)
+    logging.debug(f"Fetched {len(seen)} burn validations")
+    return list(seen.values())
+
+
+# Fields every validator must agree on for a withdrawal to go through
+WITHDRAWAL_FIELDS = ("Amount", "Nonce", "Address", "Cur")
+
+
+class BurnValidationAggregator:
+    """
+    Indexes burn validations by TXID and ValidatorID as they arrive.
+    A withdrawal becomes ready once `quorum` distinct validators have signed the same TXID
+    with the same amount, nonce, address and currency. Records of a TXID are grouped by
+    those fields, so a faulty validator disagreeing with the others never keeps the
+    agreeing ones from reaching the quorum. A TXID handed out by `take_ready()` stays
+    tracked, and keeps collecting late signatures, until it is either `complete()`d or
+    `release()`d to be handed out again.
+    """
+
+    def __init__(self, quorum=2):
+        self.quorum = quorum
+        # TXID -> withdrawal fields -> ValidatorID -> record
+        self._validations = OrderedDict()
+        self._ready = OrderedDict()
+        self._in_flight = set()
+        self._done = set()
+        self._callbacks = []
+
+    def __len__(self):
+        return len(self._validations)
+
+    def on_quorum(self, callback):
+        """
+        Registers `callback(txid, burn_validations)`, called when a TXID reaches the quorum.
+        """
+        self._callbacks.append(callback)
+
+    def add(self, burn_validation) -> bool:
+        """
+        Adds one validation and returns True if its TXID just reached the quorum.
+        """
+        txid = str(burn_validation["TXID"]).lower()
+        if txid in self._done:
+            return False
+        variants = self._validations.setdefault(txid, OrderedDict())
+        fields = tuple(burn_validation.get(field) for field in WITHDRAWAL_FIELDS)
+        validator_id = burn_validation["ValidatorID"]
+        if fields not in variants and variants:
+            logging.warning(f"Validator {validator_id} disagrees with other validators on {txid}")
+        validators = variants.setdefault(fields, {})
+        if validator_id in validators:
+            return False
+        validators[validator_id] = burn_validation
+
+        if len(validators) < self.quorum or txid in self._in_flight:
+            return False
+        if len(validators) > self.quorum or txid in self._ready:
+            # Late signatures still go into a withdrawal that has not been handed out
+            if txid in self._ready:
+                self._ready[txid] = self.group(txid)
+            return False
+        group = self.group(txid)
+        self._ready[txid] = group
+        for callback in self._callbacks:
+            try:
+                callback(txid, group)
+            except Exception as e:
+                logging.error(f"Error in burn validation callback: {e}")
+        return True
+
+    def extend(self, burn_validations) -> int:
+        return sum(1 for burn_validation in burn_validations if self.add(burn_validation))
+
+    def _best(self, txid) -> dict:
+        # The set of agreeing validators with the most signatures, the earliest on a tie
+        variants = self._validations.get(str(txid).lower())
+        return max(variants.values(), key=len) if variants else {}
+
+    def group(self, txid) -> list:
+        """
+        Returns the largest group of agreeing validations of a TXID, ordered by ValidatorID.
+        """
+        validators = self._best(txid)
+        return [validators[validator_id] for validator_id in sorted(validators)]
+
+    def pending(self) -> list:
+        """
+        Returns the TXIDs still short of the quorum.
+        """
+        return [txid for txid in self._validations
+                if len(self._best(txid)) < self.quorum and txid not in self._in_flight]
+
+    def take_ready(self) -> OrderedDict:
+        """
+        Returns the TXIDs that reached the quorum since the last call, with their validations,
+        and marks them as handed out.
+        """
+        ready, self._ready = self._ready, OrderedDict()
+        self._in_flight.update(ready)
+        return ready
+
+    def complete(self, txid):
+        """
+        Stops tracking a handed-out TXID for good; later records of it are ignored.
+        """
+        txid = str(txid).lower()
+        self._in_flight.discard(txid)
+        self._validations.pop(txid, None)
+        self._done.add(txid)
+
+    def release(self, txid):
+        """
+        Hands a TXID back after a failed withdrawal, so that `take_ready()` returns it
+        again, with any signatures that arrived in the meantime.
+        """
+        txid = str(txid).lower()
+        self._in_flight.discard(txid)
+        if txid not in self._done and len(self._best(txid)) >= self.quorum:
+            self._ready[txid] = self.group(txid)
+
+
+async def verify_withdrawals(verifier, groups, signed_arguments, quorum=1) -> OrderedDict:
+    """
+    Checks every validator signature of the TXID groups locally with a SignatureVerifier.
+    `signed_arguments(burn_validation)` returns the (types, values) the validator signed.
+    A group is kept unchanged only if all its signatures verify and come from at least
+    `quorum` distinct validator keys; otherwise the whole TXID is held back, so no
+    withdrawal goes out with fewer or substituted signatures.
+    """
+    records = [burn_validation for group in groups.values() for burn_validation in group]
+    items = [(*signed_arguments(burn_validation), burn_validation["SignatureValidator"]) for burn_validation in records]
+    signers = iter(await verifier.recover_batch(items))
+
+    verified = OrderedDict()
+    for txid, group in groups.items():
+        valid = set()
+        invalid = []
+        for burn_validation in group:
+            signer = next(signers)
+            if signer in verifier.validators:
+                valid.add(signer)
+            else:
+                invalid.append(burn_validation["ValidatorID"])
+        if invalid:
+            logging.warning(f"Invalid signatures of validators {invalid} for {txid}; not sending it")
+        elif len(valid) < quorum:
+            logging.warning(f"Withdrawal {txid} has {len(valid)} distinct validator keys, {quorum} needed; not sending it")
+        else:
+            verified[txid] = group
+    return verified
+
+
+class BurnValidationWatcher:
+    """
+    Long-lived watcher that polls GetBurnValidations on the shared session.
+    Records already seen, and TXIDs already handed out, are skipped on every poll, so only
+    new validations reach the aggregator. Whenever TXIDs reach the quorum they are passed
+    to `on_ready(groups)` (a coroutine, e.g. a WithdrawalProcessor run) in the background,
+    so polling goes on while earlier withdrawals wait for their receipts.
+    `on_ready` returns the processor results. Only withdrawals that never reached the
+    chain (build, sign or send errors, groups held back by verification) are handed back
+    to the aggregator, to be retried after a doubling delay, at most `max_attempts` times.
+    A reverted withdrawal is final. One that was broadcast but not confirmed in time is
+    never rebuilt: `receipts` keeps waiting on the same hash, for up to `max_attempts`
+    more timeouts.
+    """
+
+    def __init__(self, session, user_id, node_id, aggregator, on_ready, interval=5.0, accept=None, max_attempts=5,
+                 receipts=None, receipt_timeout=300):
+        self.session = session
+        self.user_id = user_id
+        self.node_id = node_id
+        self.aggregator = aggregator
+        self.on_ready = on_ready
+        self.interval = interval
+        self.accept = accept
+        self.max_attempts = max_attempts
+        self.receipts = receipts
+        self.receipt_timeout = receipt_timeout
+        self._seen = set()
+        self._done = set()
+        self._attempts = {}
+        self._retry_at = {}
+        self._task = None
+        self._handlers = set()
+        self._waiters = set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        # Transactions still unconfirmed stay on the chain, only the bookkeeping stops
+        for waiter in self._waiters:
+            waiter.cancel()
+        await asyncio.gather(*self._waiters, return_exceptions=True)
+
+    async def poll(self) -> int:
+        """
+        Fetches the pending validations once and hands out the TXIDs that became ready.
+        Returns the number of new records.
+        """
+        new = []
+        for burn_validation in await fetch_burn_validations(self.session, self.user_id, self.node_id):
+            key = validation_key(burn_validation)
+            if key in self._seen or key[0] in self._done:
+                continue
+            self._seen.add(key)
+            if self.accept is None or self.accept(burn_validation):
+                new.append(burn_validation)
+        self.aggregator.extend(new)
+
+        ready = self.aggregator.take_ready()
+        now = asyncio.get_running_loop().time()
+        for txid in [txid for txid in ready if self._retry_at.get(txid, 0) > now]:
+            # Not due for another attempt yet
+            del ready[txid]
+            self.aggregator.release(txid)
+        if ready:
+            logging.info(f"{len(ready)} withdrawals ready to execute")
+            handler = asyncio.ensure_future(self._handle(ready))
+            self._handlers.add(handler)
+            handler.add_done_callback(self._handlers.discard)
+        return len(new)
+
+    async def _handle(self, ready):
+        try:
+            results = await self.on_ready(ready) or []
+        except Exception as e:
+            logging.error(f"Error executing withdrawals {list(ready)}: {e}")
+            results = []
+        results = {result["TXID"]: result for result in results}
+        for txid in ready:
+            result = results.get(txid, {})
+            if "Receipt" in result:
+                if result["Receipt"].get("status") != 1:
+                    logging.error(f"Withdrawal {txid} reverted in {result['Hash']}, not retrying")
+                self._finish(txid)
+                continue
+            if "Hash" in result:
+                # Broadcast already: a new transaction could execute the withdrawal twice
+                waiter = asyncio.ensure_future(self._wait_receipt(txid, result["Hash"]))
+                self._waiters.add(waiter)
+                waiter.add_done_callback(self._waiters.discard)
+                continue
+            attempts = self._attempts.get(txid, 0) + 1
+            if attempts >= self.max_attempts:
+                logging.error(f"Giving up on withdrawal {txid} after {attempts} attempts")
+                self._finish(txid)
+                continue
+            self._attempts[txid] = attempts
+            self._retry_at[txid] = asyncio.get_running_loop().time() + self.interval * 2 ** attempts
+            logging.warning(f"Withdrawal {txid} not executed, retrying (attempt {attempts + 1})")
+            self.aggregator.release(txid)
+
+    async def _wait_receipt(self, txid, tx_hash):
+        if self.receipts is None:
+            logging.error(f"Withdrawal {txid} not confirmed in {tx_hash} and no receipt tracker to keep waiting")
+            self._finish(txid)
+            return
+        for _ in range(self.max_attempts):
+            logging.warning(f"Withdrawal {txid} not confirmed yet, still waiting on {tx_hash}")
+            try:
+                receipt = await self.receipts.wait(tx_hash, timeout=self.receipt_timeout)
+            except TimeoutError:
+                continue
+            except Exception as e:
+                logging.error(f"Waiting on withdrawal {txid} in {tx_hash} failed: {e}")
+                break
+            if receipt.get("status") != 1:
+                logging.error(f"Withdrawal {txid} reverted in {tx_hash}, not retrying")
+            else:
+                logging.info(f"Withdrawal {txid} confirmed in {tx_hash}")
+            break
+        else:
+            logging.error(f"Giving up on withdrawal {txid}: {tx_hash} still not confirmed")
+        self._finish(txid)
+
+    def _finish(self, txid):
+        self.aggregator.complete(txid)
+        self._done.add(txid)
+        self._attempts.pop(txid, None)
+        self._retry_at.pop(txid, None)
+        # Records of finished TXIDs are skipped through _done from now on
+        self._seen = {key for key in self._seen if key[0] != txid}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                logging.warning(f"Polling burn validations failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+class WithdrawalProcessor:
+    """
+    Executes many withdrawals back-to-back from one account.
+    `build_withdraw(burn_validations)` turns the validations of one TXID into the contract
+    function to call (or None to skip it). Transactions are built, signed and broadcast
+    one after the other with consecutive nonces from the nonce manager, without waiting
+    for any of them to be mined; the receipt tracker then waits for all of them at once.
+    """
+
+    def __init__(self, web3, account, private_key, nonces, fees, receipts, build_withdraw, chain_id, gas=300000):
+        self.web3 = web3
+        self.account = account
+        self.private_key = private_key
+        self.nonces = nonces
+        self.fees = fees
+        self.receipts = receipts
+        self.build_withdraw = build_withdraw
+        self.chain_id = chain_id
+        self.gas = gas
+
+    async def submit(self, txid, burn_validations):
+        """
+        Builds, signs and broadcasts the withdrawal of one TXID and returns its hash.
+        """
+        function = self.build_withdraw(burn_validations)
+        if function is None:
+            return None
+        async with self.nonces.reserve() as nonce:
+            transaction = await function.build_transaction({
+                "chainId": self.chain_id,
+                "from": self.account.address,
+                "gas": self.gas,
+                **await self.fees.fee_params(),
+                "nonce": nonce
+            })
+            signed_tx = self.web3.eth.account.sign_transaction(transaction, self.private_key)
+            tx_hash = await self.web3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        logging.info(f"Withdraw of {txid} sent with nonce {nonce}: {self.web3.to_hex(tx_hash)}")
+        return tx_hash
+
+    async def process(self, groups, timeout=300) -> list:
+        """
+        Submits the withdrawals of all TXID groups (see `BurnValidationAggregator.take_ready`)
+        and waits for their receipts.
+        Returns one {"TXID", "Hash", "Receipt" | "Error" | "Skipped"} entry per group.
+        """
+        results = []
+        for txid, burn_validations in groups.items():
+            try:
+                tx_hash = await self.submit(txid, burn_validations)
+                if tx_hash is None:
+                    results.append({"TXID": txid, "Skipped": True})
+                else:
+                    results.append({"TXID": txid, "Hash": self.web3.to_hex(tx_hash)})
+            except Exception as e:
+                logging.error(f"Withdraw of {txid} failed: {e}")
+                results.append({"TXID": txid, "Error": str(e)})
+
+        sent = [result for result in results if "Hash" in result]
+        receipts = await asyncio.gather(
+            *[self.receipts.wait(result["Hash"], timeout=timeout) for result in sent],
+            return_exceptions=True
+        )
+        for result, receipt in zip(sent, receipts):
+            if isinstance(receipt, Exception):
+                result["Error"] = str(receipt)
+            else:
+                result["Receipt"] = receipt
+                if receipt.get("status") != 1:
+                    result["Error"] = "reverted"
+
+        failed = sum(1 for result in results if "Error" in result)
+        logging.info(f"Processed {len(results)} withdrawals: {len(sent)} sent, {failed} failed")
+        return results